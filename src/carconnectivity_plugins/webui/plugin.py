@@ -3,8 +3,9 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 import logging
-import threading
 import locale
+import os
+import ssl
 
 from werkzeug.serving import _TSSLContextArg
 
@@ -12,10 +13,17 @@ from carconnectivity.errors import ConfigurationError
 from carconnectivity.util import config_remove_credentials
 from carconnectivity_plugins.base.plugin import BasePlugin
 from carconnectivity_plugins.webui.ui.webui import WebUI
+from carconnectivity_plugins.webui.ui.federation import Federation, RemoteInstance
+from carconnectivity_plugins.webui.ui.admission import AdmissionController, ROUTE_CLASSES
+from carconnectivity_plugins.webui.ui.snapshot import SnapshotStore
+from carconnectivity_plugins.webui.ui.compression import Compressor, ENCODINGS, COMPRESSIBLE_MIMETYPES, available_encodings
+from carconnectivity_plugins.webui.ui.memory import MemoryMonitor, BUDGETS, MEGABYTE
+from carconnectivity_plugins.webui.ui.tls import create_ssl_context, ensure_self_signed_certificate
+from carconnectivity_plugins.webui.ui.webhooks import Webhook, WebhookDispatcher
 from carconnectivity_plugins.webui._version import __version__
 
 if TYPE_CHECKING:
-    from typing import Dict, Optional
+    from typing import Any, Dict, List, Optional
     from carconnectivity.carconnectivity import CarConnectivity
 
 # pylint: disable=duplicate-code
@@ -41,13 +49,11 @@ class Plugin(BasePlugin):  # pylint: disable=too-many-instance-attributes
         car_connectivity (CarConnectivity): An instance of CarConnectivity.
         config (Dict): Configuration dictionary containing connection details.
     """
-    # pylint: disable-next=too-many-branches, too-many-statements
+    # pylint: disable-next=too-many-branches, too-many-statements, too-many-locals
     def __init__(self, plugin_id: str, car_connectivity: CarConnectivity, config: Dict, *args, initialization: Optional[Dict] = None, **kwargs) -> None:
         BasePlugin.__init__(self, plugin_id=plugin_id, car_connectivity=car_connectivity, config=config, log=LOG, *args, initialization=initialization,
                             **kwargs)
 
-        self.webthread: Optional[threading.Thread] = None
-
         werkzeug_logger: logging.Logger = logging.getLogger('werkzeug')
         if 'log_level' in self.active_config and self.active_config['log_level'] is not None:
             werkzeug_logger.setLevel(self.active_config['log_level'])
@@ -108,27 +114,214 @@ class Plugin(BasePlugin):  # pylint: disable=too-many-instance-attributes
         ssl_context: Optional[_TSSLContextArg] = None
         if 'https' in config and config['https']:
             self.active_config['https'] = True
+            if 'ssl_alpn_protocols' in config and config['ssl_alpn_protocols'] is not None:
+                self.active_config['ssl_alpn_protocols'] = config['ssl_alpn_protocols']
+            else:
+                self.active_config['ssl_alpn_protocols'] = ['http/1.1']
+            if 'ssl_session_tickets' in config and config['ssl_session_tickets'] is not None:
+                self.active_config['ssl_session_tickets'] = config['ssl_session_tickets']
+                if self.active_config['ssl_session_tickets'] < 0:
+                    raise ConfigurationError('Invalid ssl_session_tickets specified in config ("ssl_session_tickets" must not be negative)')
+            else:
+                self.active_config['ssl_session_tickets'] = 2
             if 'ssl_certificate_file' in config and 'ssl_certificate_key_file' in config:
                 self.active_config['ssl_certificate_file'] = config['ssl_certificate_file']
                 self.active_config['ssl_certificate_key_file'] = config['ssl_certificate_key_file']
-                ssl_context = (config['ssl_certificate_file'], config['ssl_certificate_key_file'])
             else:
-                ssl_context = 'adhoc'
+                if 'ssl_self_signed_certificate' in config and config['ssl_self_signed_certificate'] is not None:
+                    self.active_config['ssl_self_signed_certificate'] = config['ssl_self_signed_certificate']
+                else:
+                    self.active_config['ssl_self_signed_certificate'] = os.path.join(os.path.expanduser('~'), '.carconnectivity', 'webui_selfsigned')
+                common_name: Optional[str] = None if self.active_config['host'] in ('0.0.0.0', '::') else self.active_config['host']  # nosec
+                try:
+                    self.active_config['ssl_certificate_file'], self.active_config['ssl_certificate_key_file'] = \
+                        ensure_self_signed_certificate(self.active_config['ssl_self_signed_certificate'], common_name=common_name)
+                except ImportError as err:
+                    raise ConfigurationError(str(err)) from err
+                except OSError as err:
+                    raise ConfigurationError(f'Cannot store self-signed certificate at {self.active_config["ssl_self_signed_certificate"]}: {err}') from err
+            try:
+                ssl_context = create_ssl_context(self.active_config['ssl_certificate_file'], self.active_config['ssl_certificate_key_file'],
+                                                 alpn_protocols=self.active_config['ssl_alpn_protocols'],
+                                                 session_tickets=self.active_config['ssl_session_tickets'])
+            except (OSError, ssl.SSLError) as err:
+                raise ConfigurationError(f'Cannot load certificate for https: {err}') from err
         else:
             self.active_config['https'] = False
 
+        if 'config_file' in config and config['config_file'] is not None:
+            self.active_config['config_file'] = config['config_file']
+        else:
+            self.active_config['config_file'] = None
+
+        if 'drain_timeout' in config and config['drain_timeout'] is not None:
+            self.active_config['drain_timeout'] = config['drain_timeout']
+            if self.active_config['drain_timeout'] < 0:
+                raise ConfigurationError('Invalid drain_timeout specified in config ("drain_timeout" must not be negative)')
+        else:
+            self.active_config['drain_timeout'] = 10
+
+        self.federation: Optional[Federation] = None
+        if 'federation' in config and config['federation'] is not None:
+            federation_config: Dict = config['federation']
+            if 'interval' in federation_config and federation_config['interval'] is not None:
+                if federation_config['interval'] <= 0:
+                    raise ConfigurationError('Invalid federation interval specified in config ("interval" must be greater than 0)')
+                federation_interval: float = federation_config['interval']
+            else:
+                federation_interval = 30
+            remotes: List[RemoteInstance] = []
+            for remote_config in federation_config.get('remotes', []):
+                if 'name' not in remote_config or 'url' not in remote_config:
+                    raise ConfigurationError('Invalid federation remote specified in config ("name" and "url" are mandatory)')
+                if remote_config['name'] in ('local', 'federation') or remote_config['name'] in [remote.name for remote in remotes]:
+                    raise ConfigurationError(f'Invalid federation remote name "{remote_config["name"]}" in config (must be unique and not '
+                                             '"local" or "federation")')
+                remotes.append(RemoteInstance(name=remote_config['name'], url=remote_config['url'], username=remote_config.get('username'),
+                                              password=remote_config.get('password'), timeout=remote_config.get('timeout', 10),
+                                              verify=remote_config.get('verify', True)))
+            self.federation = Federation(remotes=remotes, interval=federation_interval)
+            self.active_config['federation'] = {'interval': federation_interval,
+                                                'remotes': [{'name': remote.name, 'url': remote.url, 'timeout': remote.timeout} for remote in remotes]}
+
+        admission_config: Dict[str, Any] = {'enabled': False, 'limits': {'health': 4, 'api': 8, 'html': 4, 'images': 8, 'logs': 2}, 'max_concurrent': 12,
+                                            'max_queue': 32, 'max_wait': 10, 'retry_after': 2, 'api_rate': None, 'api_burst': None}
+        if 'admission_control' in config and config['admission_control'] is not None:
+            for key, value in config['admission_control'].items():
+                if key not in admission_config:
+                    raise ConfigurationError(f'Invalid option "{key}" in admission_control config')
+                if key == 'limits':
+                    for route_class, limit in value.items():
+                        if route_class not in ROUTE_CLASSES:
+                            raise ConfigurationError(f'Invalid route class "{route_class}" in admission_control limits (must be one of {ROUTE_CLASSES})')
+                        if limit < 1:
+                            raise ConfigurationError(f'Invalid limit for route class "{route_class}" in admission_control (must be at least 1)')
+                        admission_config['limits'][route_class] = limit
+                else:
+                    admission_config[key] = value
+            for key in ('max_concurrent', 'max_queue', 'max_wait'):
+                if admission_config[key] < 1:
+                    raise ConfigurationError(f'Invalid {key} in admission_control config (must be at least 1)')
+            if admission_config['api_rate'] is not None and admission_config['api_rate'] <= 0:
+                raise ConfigurationError('Invalid api_rate in admission_control config (must be greater than 0)')
+            if admission_config['api_burst'] is not None and admission_config['api_burst'] < 1:
+                raise ConfigurationError('Invalid api_burst in admission_control config (must be at least 1)')
+            if admission_config['retry_after'] < 0:
+                raise ConfigurationError('Invalid retry_after in admission_control config (must not be negative)')
+        self.active_config['admission_control'] = admission_config
+        admission: Optional[AdmissionController] = None
+        if admission_config['enabled']:
+            admission = AdmissionController(limits=admission_config['limits'], max_concurrent=admission_config['max_concurrent'],
+                                            max_queue=admission_config['max_queue'], max_wait=admission_config['max_wait'],
+                                            api_rate=admission_config['api_rate'], api_burst=admission_config['api_burst'])
+
+        compression_config: Dict[str, Any] = {'enabled': True, 'min_size': 1024, 'encodings': list(ENCODINGS), 'mimetypes': list(COMPRESSIBLE_MIMETYPES),
+                                              'cache_timeout': 60}
+        if 'compression' in config and config['compression'] is not None:
+            for key, value in config['compression'].items():
+                if key not in compression_config:
+                    raise ConfigurationError(f'Invalid option "{key}" in compression config')
+                if key == 'encodings':
+                    for encoding in value:
+                        if encoding not in ENCODINGS:
+                            raise ConfigurationError(f'Invalid encoding "{encoding}" in compression config (must be one of {ENCODINGS})')
+                        if encoding not in available_encodings():
+                            LOG.warning('Compression with %s is not available, install carconnectivity-plugin-webui[compression]', encoding)
+                compression_config[key] = value
+            if compression_config['min_size'] < 0:
+                raise ConfigurationError('Invalid min_size in compression config (must not be negative)')
+            if 'text/html' in compression_config['mimetypes']:
+                LOG.warning('Compression of text/html is enabled, pages contain CSRF tokens that can be exposed by BREACH style attacks')
+        self.active_config['compression'] = compression_config
+        compressor: Optional[Compressor] = None
+        if compression_config['enabled']:
+            compressor = Compressor(encodings=compression_config['encodings'], mimetypes=compression_config['mimetypes'],
+                                    min_size=compression_config['min_size'], cache_timeout=compression_config['cache_timeout'])
+
+        memory_budgets: Dict[str, Optional[int]] = {budget: None for budget in BUDGETS}
+        if 'memory_budgets' in config and config['memory_budgets'] is not None:
+            for budget, megabytes in config['memory_budgets'].items():
+                if budget not in BUDGETS:
+                    raise ConfigurationError(f'Invalid memory budget "{budget}" in config (must be one of {BUDGETS})')
+                if megabytes is not None and megabytes <= 0:
+                    raise ConfigurationError(f'Invalid memory budget for "{budget}" in config (must be greater than 0 megabytes)')
+                memory_budgets[budget] = int(megabytes * MEGABYTE) if megabytes is not None else None
+        self.active_config['memory_budgets'] = {budget: (value // MEGABYTE if value is not None else None) for budget, value in memory_budgets.items()}
+        if 'memory_check_interval' in config and config['memory_check_interval'] is not None:
+            self.active_config['memory_check_interval'] = config['memory_check_interval']
+            if self.active_config['memory_check_interval'] <= 0:
+                raise ConfigurationError('Invalid memory_check_interval specified in config ("memory_check_interval" must be greater than 0)')
+        else:
+            self.active_config['memory_check_interval'] = 30
+        self.memory_monitor: MemoryMonitor = MemoryMonitor(car_connectivity, budgets=memory_budgets, interval=self.active_config['memory_check_interval'])
+
+        self.webhooks: Optional[WebhookDispatcher] = None
+        if 'webhooks' in config and config['webhooks'] is not None:
+            webhooks_config: Dict[str, Any] = {'max_queue': 1000, 'max_dead_letters': 100, 'endpoints': []}
+            for key, value in config['webhooks'].items():
+                if key not in webhooks_config:
+                    raise ConfigurationError(f'Invalid option "{key}" in webhooks config')
+                webhooks_config[key] = value
+            if webhooks_config['max_queue'] < 1 or webhooks_config['max_dead_letters'] < 1:
+                raise ConfigurationError('Invalid webhooks config ("max_queue" and "max_dead_letters" must be at least 1)')
+            endpoint_options: List[str] = ['name', 'url', 'paths', 'headers', 'secret', 'timeout', 'verify', 'batch_size', 'max_delay',
+                                           'max_retries', 'backoff', 'max_backoff']
+            webhooks: List[Webhook] = []
+            for endpoint_config in webhooks_config['endpoints']:
+                for key in endpoint_config:
+                    if key not in endpoint_options:
+                        raise ConfigurationError(f'Invalid option "{key}" in webhooks endpoint config')
+                if 'name' not in endpoint_config or 'url' not in endpoint_config:
+                    raise ConfigurationError('Invalid webhooks endpoint specified in config ("name" and "url" are mandatory)')
+                if endpoint_config['name'] in [webhook.name for webhook in webhooks]:
+                    raise ConfigurationError(f'Invalid webhooks endpoint name "{endpoint_config["name"]}" in config (must be unique)')
+                if not endpoint_config['url'].startswith(('http://', 'https://')):
+                    raise ConfigurationError(f'Invalid url for webhooks endpoint "{endpoint_config["name"]}" in config (must be http or https)')
+                if endpoint_config.get('batch_size', 1) < 1 or endpoint_config.get('max_delay', 0) < 0 or endpoint_config.get('max_retries', 0) < 0:
+                    raise ConfigurationError(f'Invalid webhooks endpoint "{endpoint_config["name"]}" in config ("batch_size" must be at least 1, '
+                                             '"max_delay" and "max_retries" must not be negative)')
+                webhooks.append(Webhook(**endpoint_config))
+            self.webhooks = WebhookDispatcher(car_connectivity, webhooks=webhooks, max_queue=webhooks_config['max_queue'],
+                                              max_dead_letters=webhooks_config['max_dead_letters'])
+            self.active_config['webhooks'] = {'max_queue': webhooks_config['max_queue'], 'max_dead_letters': webhooks_config['max_dead_letters'],
+                                              'endpoints': [{'name': webhook.name, 'url': webhook.url, 'paths': webhook.paths,
+                                                             'batch_size': webhook.batch_size, 'max_delay': webhook.max_delay,
+                                                             'max_retries': webhook.max_retries} for webhook in webhooks]}
+
+        self.snapshot: Optional[SnapshotStore] = None
+        if 'snapshot_file' in config and config['snapshot_file'] is not None:
+            self.active_config['snapshot_file'] = config['snapshot_file']
+            if 'snapshot_interval' in config and config['snapshot_interval'] is not None:
+                self.active_config['snapshot_interval'] = config['snapshot_interval']
+                if self.active_config['snapshot_interval'] <= 0:
+                    raise ConfigurationError('Invalid snapshot_interval specified in config ("snapshot_interval" must be greater than 0)')
+            else:
+                self.active_config['snapshot_interval'] = 60
+            self.snapshot = SnapshotStore(car_connectivity=car_connectivity, path=self.active_config['snapshot_file'],
+                                          interval=self.active_config['snapshot_interval'])
+        else:
+            self.active_config['snapshot_file'] = None
+
         self.webui = WebUI(car_connectivity=car_connectivity, host=self.active_config['host'], port=self.active_config['port'],
                            app_config=self.active_config['app_config'], users=users, locale=self.active_config['locale'],
-                           ssl_context=ssl_context)
+                           ssl_context=ssl_context, config_file=self.active_config['config_file'],
+                           drain_timeout=self.active_config['drain_timeout'], federation=self.federation, admission=admission,
+                           retry_after=admission_config['retry_after'], snapshot=self.snapshot,
+                           compressor=compressor, memory_monitor=self.memory_monitor)
 
         LOG.info("Loading webui plugin with config %s", config_remove_credentials(config))
 
     def startup(self) -> None:
         LOG.info("Starting WebUI plugin")
         self.webui.load_blueprints()
-        self.webthread = threading.Thread(target=self.webui.server.serve_forever)
-        self.webthread.name = 'carconnectivity.plugins.webui-webthread'
-        self.webthread.start()
+        self.webui.start_server()
+        if self.federation is not None:
+            self.federation.start()
+        if self.snapshot is not None:
+            self.snapshot.start()
+        if self.webhooks is not None:
+            self.webhooks.start()
+        self.memory_monitor.start()
         self.healthy._set_value(value=True)  # pylint: disable=protected-access
         LOG.debug("Starting WebUI plugin done")
 
@@ -137,8 +330,15 @@ class Plugin(BasePlugin):  # pylint: disable=too-many-instance-attributes
         Shuts down the connector by persisting current state, closing the session,
         and cleaning up resources.
         """
-        if self.webthread is not None and self.webthread.is_alive():
-            self.webui.server.shutdown()
+        if self.federation is not None:
+            self.federation.stop()
+        if self.snapshot is not None:
+            self.snapshot.stop()
+        if self.webhooks is not None:
+            self.webhooks.stop()
+        self.memory_monitor.stop()
+        if not self.webui.stop_server(drain_timeout=self.active_config['drain_timeout']):
+            LOG.warning('WebUI stopped with %d requests still in flight', self.webui.inflight_requests)
         return super().shutdown()
 
     def get_version(self) -> str:
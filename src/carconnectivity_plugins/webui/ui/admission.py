@@ -0,0 +1,287 @@
+""" Admission control and load shedding for the web UI"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from werkzeug.wsgi import ClosingIterator
+
+if TYPE_CHECKING:
+    from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+    from _typeshed.wsgi import WSGIApplication, WSGIEnvironment, StartResponse
+
+# Route classes in order of their priority, requests of classes earlier in the list are admitted first
+ROUTE_CLASSES: List[str] = ['health', 'api', 'html', 'images', 'logs']
+
+# Paths that are answered with machine readable data but do not end in json
+API_PATHS: Tuple[str, ...] = ('/restart/status', '/admission/status', '/tls/status', '/compression/status', '/debug/memory')
+
+# Paths that are not subject to admission control, like static files they are cheap and cached by the browser
+EXEMPT_PATHS: Tuple[str, ...] = ('/service-worker.js', '/manifest.webmanifest')
+
+# Extensions of images, e.g. vehicle images. A page loads many of them at once, so they must not take the slots of the pages
+IMAGE_EXTENSIONS: Tuple[str, ...] = ('.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp', '.ico')
+
+
+def classify(path: str) -> Optional[str]:
+    """
+    Determine the route class of a request path.
+
+    Args:
+        path (str): The path of the request.
+
+    Returns:
+        Optional[str]: The route class or None for requests that are not subject to admission control (static files).
+    """
+    if path.startswith('/static/') or path in EXEMPT_PATHS:
+        return None
+    if path == '/healthcheck':
+        return 'health'
+    if path == '/log' or path.endswith('/log'):
+        return 'logs'
+    if path.endswith('/json') or path.endswith('.json') or path in API_PATHS:
+        return 'api'
+    if path.lower().endswith(IMAGE_EXTENSIONS):
+        return 'images'
+    return 'html'
+
+
+class TokenBucket:  # pylint: disable=too-few-public-methods
+    """
+    Token bucket that refills with `rate` tokens per second up to `burst` tokens.
+
+    Raises:
+        ValueError: If rate is not greater than 0 or burst is less than 1, a bucket that cannot hold a whole token never admits a request.
+    """
+    def __init__(self, rate: float, burst: float) -> None:
+        if rate <= 0 or burst < 1:
+            raise ValueError(f'Rate of a token bucket must be greater than 0 and burst at least 1 (rate {rate}, burst {burst})')
+        self.rate: float = rate
+        self.burst: float = burst
+        self.tokens: float = burst
+        self.last: float = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Take one token from the bucket.
+
+        Returns:
+            float: 0 if a token was available, otherwise the time in seconds until the next token is available.
+        """
+        now: float = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class _Waiter:  # pylint: disable=too-few-public-methods
+    def __init__(self, route_class: str) -> None:
+        self.route_class: str = route_class
+        self.granted: bool = False
+        self.rejected: bool = False
+
+
+class AdmissionController:  # pylint: disable=too-many-instance-attributes
+    """
+    Limits the number of concurrently processed requests per route class and in total.
+
+    Requests that cannot be processed immediately wait in a bounded queue ordered by the priority of their route class
+    (health, api, html, images, logs). When the queue is full, a waiting request of lower priority is shed in favour of a new request of
+    higher priority. Requests that cannot be queued or wait longer than `max_wait` are rejected. Health checks only count against
+    their own limit, so they are answered even when all other slots are taken.
+
+    API requests can additionally be rate limited per client with a token bucket.
+
+    Args:
+        limits (Dict[str, int]): Maximum number of concurrent requests per route class.
+        max_concurrent (int): Maximum number of concurrent requests of all classes except health.
+        max_queue (int): Maximum number of waiting requests.
+        max_wait (float): Maximum time in seconds a request waits for admission.
+        api_rate (Optional[float]): Sustained API requests per second per client, None disables rate limiting.
+        api_burst (Optional[float]): Number of API requests a client can make in a burst, defaults to 10 times `api_rate` but at least 1.
+        max_clients (int): Maximum number of clients for which token buckets are kept.
+    """
+    # pylint: disable-next=too-many-arguments, too-many-positional-arguments
+    def __init__(self, limits: Dict[str, int], max_concurrent: int, max_queue: int, max_wait: float, api_rate: Optional[float] = None,
+                 api_burst: Optional[float] = None, max_clients: int = 1024) -> None:
+        self.limits: Dict[str, int] = limits
+        self.max_concurrent: int = max_concurrent
+        self.max_queue: int = max_queue
+        self.max_wait: float = max_wait
+        self.api_rate: Optional[float] = api_rate
+        self.api_burst: float = api_burst if api_burst is not None else (max(api_rate * 10, 1) if api_rate is not None else 0)
+        self.max_clients: int = max_clients
+        self.condition: threading.Condition = threading.Condition()
+        self.active: Dict[str, int] = {route_class: 0 for route_class in ROUTE_CLASSES}
+        self.queue: List[Tuple[int, int, _Waiter]] = []
+        self.sequence = itertools.count()
+        self.buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self.buckets_lock: threading.Lock = threading.Lock()
+        self.admitted: Dict[str, int] = {route_class: 0 for route_class in ROUTE_CLASSES}
+        self.queued: Dict[str, int] = {route_class: 0 for route_class in ROUTE_CLASSES}
+        self.rejected: Dict[str, int] = {route_class: 0 for route_class in ROUTE_CLASSES}
+        self.shed: Dict[str, int] = {route_class: 0 for route_class in ROUTE_CLASSES}
+        self.rate_limited: int = 0
+
+    def _total_active(self) -> int:
+        return sum(active for route_class, active in self.active.items() if route_class != 'health')
+
+    def _has_capacity(self, route_class: str) -> bool:
+        if self.active[route_class] >= self.limits[route_class]:
+            return False
+        return route_class == 'health' or self._total_active() < self.max_concurrent
+
+    def _dispatch(self) -> None:
+        # Grant free slots to waiting requests in order of priority, a class without capacity does not block other classes
+        remaining: List[Tuple[int, int, _Waiter]] = []
+        while self.queue:
+            entry: Tuple[int, int, _Waiter] = heapq.heappop(self.queue)
+            waiter: _Waiter = entry[2]
+            if self._has_capacity(waiter.route_class):
+                waiter.granted = True
+                self.active[waiter.route_class] += 1
+            else:
+                remaining.append(entry)
+        for entry in remaining:
+            heapq.heappush(self.queue, entry)
+        self.condition.notify_all()
+
+    def rate_limit(self, client: str) -> float:
+        """
+        Take a token from the bucket of the client.
+
+        Args:
+            client (str): Identifier of the client, e.g. its address.
+
+        Returns:
+            float: 0 if the request may proceed, otherwise the time in seconds after which the client should retry.
+        """
+        if self.api_rate is None:
+            return 0
+        with self.buckets_lock:
+            bucket: Optional[TokenBucket] = self.buckets.pop(client, None)
+            if bucket is None:
+                bucket = TokenBucket(self.api_rate, self.api_burst)
+                while len(self.buckets) >= self.max_clients:
+                    self.buckets.popitem(last=False)
+            self.buckets[client] = bucket
+            retry_after: float = bucket.take()
+            if retry_after > 0:
+                self.rate_limited += 1
+            return retry_after
+
+    def acquire(self, route_class: str) -> bool:
+        """
+        Wait for admission of a request.
+
+        Args:
+            route_class (str): The route class of the request.
+
+        Returns:
+            bool: True if the request was admitted and `release` must be called when it is done, False if it was rejected.
+        """
+        priority: int = ROUTE_CLASSES.index(route_class)
+        with self.condition:
+            if self._has_capacity(route_class) and not any(entry[0] <= priority for entry in self.queue):
+                self.active[route_class] += 1
+                self.admitted[route_class] += 1
+                return True
+            if len(self.queue) >= self.max_queue:
+                lowest: Tuple[int, int, _Waiter] = max(self.queue)
+                if lowest[0] <= priority:
+                    self.rejected[route_class] += 1
+                    return False
+                self.queue.remove(lowest)
+                heapq.heapify(self.queue)
+                lowest[2].rejected = True
+                self.shed[lowest[2].route_class] += 1
+            waiter: _Waiter = _Waiter(route_class)
+            heapq.heappush(self.queue, (priority, next(self.sequence), waiter))
+            self.queued[route_class] += 1
+            self._dispatch()
+            self.condition.wait_for(lambda: waiter.granted or waiter.rejected, timeout=self.max_wait)
+            if waiter.granted:
+                self.admitted[route_class] += 1
+                return True
+            if not waiter.rejected:
+                self.queue = [entry for entry in self.queue if entry[2] is not waiter]
+                heapq.heapify(self.queue)
+            self.rejected[route_class] += 1
+            return False
+
+    def release(self, route_class: str) -> None:
+        """
+        Release the slot of an admitted request.
+
+        Args:
+            route_class (str): The route class of the request.
+        """
+        with self.condition:
+            self.active[route_class] -= 1
+            self._dispatch()
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Returns current queue depth, active requests and admission counters per route class.
+
+        Returns:
+            Dict[str, Any]: The admission status.
+        """
+        with self.condition:
+            queue_depth: Dict[str, int] = {route_class: 0 for route_class in ROUTE_CLASSES}
+            for entry in self.queue:
+                queue_depth[entry[2].route_class] += 1
+            return {
+                'queue_depth': len(self.queue),
+                'max_queue': self.max_queue,
+                'max_concurrent': self.max_concurrent,
+                'classes': {route_class: {'limit': self.limits[route_class],
+                                          'active': self.active[route_class],
+                                          'waiting': queue_depth[route_class],
+                                          'admitted': self.admitted[route_class],
+                                          'queued': self.queued[route_class],
+                                          'rejected': self.rejected[route_class],
+                                          'shed': self.shed[route_class]} for route_class in ROUTE_CLASSES},
+                'rate_limited': self.rate_limited,
+                'rate_limited_clients': len(self.buckets),
+            }
+
+    def wrap(self, wsgi_app: WSGIApplication, retry_after: int = 1) -> WSGIApplication:
+        """
+        Wrap a WSGI application with admission control. Rejected requests are answered with 503 Service Unavailable,
+        rate limited API requests with 429 Too Many Requests, both with a Retry-After header.
+
+        Args:
+            wsgi_app (WSGIApplication): The application to wrap.
+            retry_after (int): Retry-After in seconds sent with 503 responses.
+
+        Returns:
+            WSGIApplication: The wrapped application.
+        """
+        def wsgi_app_with_admission(environ: WSGIEnvironment, start_response: StartResponse) -> Iterable[bytes]:
+            route_class: Optional[str] = classify(environ.get('PATH_INFO', ''))
+            if route_class is None:
+                return wsgi_app(environ, start_response)
+            if route_class == 'api':
+                rate_limit_retry: float = self.rate_limit(environ.get('REMOTE_ADDR', ''))
+                if rate_limit_retry > 0:
+                    start_response('429 Too Many Requests', [('Content-Type', 'text/plain'), ('Retry-After', str(int(rate_limit_retry) + 1))])
+                    return [b'Too many requests, slow down polling']
+            if not self.acquire(route_class):
+                start_response('503 Service Unavailable', [('Content-Type', 'text/plain'), ('Retry-After', str(retry_after))])
+                return [b'Server is busy, try again later']
+            try:
+                # The slot is held until the server closes the body, streamed responses and files are sent after the application returned
+                return ClosingIterator(wsgi_app(environ, start_response), lambda: self.release(route_class))
+            except BaseException:
+                self.release(route_class)
+                raise
+        return wsgi_app_with_admission
@@ -1,4 +1,59 @@
 """ Cache configuration for the webui. """
+from typing import Optional
+
+import flask
 from flask_caching import Cache
 
 cache = Cache(config={'CACHE_TYPE': 'simple'})
+
+
+def make_cache_key(*args, **kwargs) -> str:
+    """
+    Cache key for views that return different representations depending on the query string and the Accept header.
+
+    Returns:
+        str: The cache key for the current request.
+    """
+    del args, kwargs
+    return f'view/{flask.request.full_path}|{flask.request.headers.get("Accept", "")}'
+
+
+def cacheable_response(response: flask.Response) -> bool:
+    """
+    Response filter for cached views: responses that must not be stored, like stale responses from the snapshot, are not cached,
+    so the live data is served as soon as it is available.
+
+    Args:
+        response (flask.Response): The response of the view.
+
+    Returns:
+        bool: True if the response may be cached.
+    """
+    return not isinstance(response, flask.Response) or not response.cache_control.no_store
+
+
+def get_compressed_body(digest: str, encoding: str) -> Optional[bytes]:
+    """
+    Get a compressed response body from the cache.
+
+    Args:
+        digest (str): Digest of the uncompressed body.
+        encoding (str): The content encoding.
+
+    Returns:
+        Optional[bytes]: The compressed body or None if it is not cached.
+    """
+    return cache.get(f'compressed/{encoding}/{digest}')
+
+
+def set_compressed_body(digest: str, encoding: str, body: bytes, timeout: int) -> None:
+    """
+    Store a compressed response body in the cache next to the cached views.
+
+    Args:
+        digest (str): Digest of the uncompressed body.
+        encoding (str): The content encoding.
+        body (bytes): The compressed body.
+        timeout (int): Seconds the body is kept in the cache.
+    """
+    cache.set(f'compressed/{encoding}/{digest}', body, timeout=timeout)
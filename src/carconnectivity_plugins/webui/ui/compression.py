@@ -0,0 +1,201 @@
+""" Compression of web UI responses"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import gzip
+import hashlib
+import threading
+import time
+
+import flask
+
+from carconnectivity_plugins.webui.ui.cache import get_compressed_body, set_compressed_body
+
+SUPPORT_BROTLI = False  # pylint: disable=invalid-name
+try:
+    import brotli
+    SUPPORT_BROTLI = True  # pylint: disable=invalid-name
+except ImportError:
+    pass
+
+SUPPORT_ZSTD = False  # pylint: disable=invalid-name
+try:
+    import zstandard
+    SUPPORT_ZSTD = True  # pylint: disable=invalid-name
+except ImportError:
+    pass
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Dict, List, Optional
+
+# Encodings in order of preference when the client accepts several with the same quality
+ENCODINGS: List[str] = ['zstd', 'br', 'gzip']
+
+# Mimetypes that are compressed by default, images and the binary output formats are already compact. HTML is left out: pages embed
+# CSRF tokens next to content that can be influenced by the client, compressing them exposes the tokens to BREACH style attacks
+COMPRESSIBLE_MIMETYPES: List[str] = ['text/css', 'text/plain', 'text/javascript', 'application/javascript', 'text/json',
+                                     'application/json', 'application/manifest+json', 'image/svg+xml']
+
+
+def available_encodings() -> List[str]:
+    """
+    Returns the content encodings that can be used with the installed libraries in order of preference.
+
+    Returns:
+        List[str]: The available encodings.
+    """
+    encodings: List[str] = []
+    if SUPPORT_ZSTD:
+        encodings.append('zstd')
+    if SUPPORT_BROTLI:
+        encodings.append('br')
+    encodings.append('gzip')
+    return encodings
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """
+    Compress data with a content encoding. The levels favour speed as responses are compressed on the fly.
+
+    Args:
+        data (bytes): The data to compress.
+        encoding (str): The content encoding, one of ENCODINGS.
+
+    Returns:
+        bytes: The compressed data.
+    """
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    raise ValueError(f'Unknown encoding {encoding}')
+
+
+class Compressor:  # pylint: disable=too-many-instance-attributes
+    """
+    Compresses responses with the best content encoding accepted by the client.
+
+    Only complete responses with status 200 of a compressible mimetype and at least `min_size` bytes are compressed. Compressed bodies
+    are stored in the cache with the digest of the uncompressed body, so the same body (e.g. a cached view) is compressed only once
+    per encoding.
+
+    Args:
+        encodings (List[str]): Encodings that may be used in order of preference.
+        mimetypes (List[str]): Mimetypes that are compressed.
+        min_size (int): Minimum size of the body in bytes to be compressed.
+        cache_timeout (int): Seconds compressed bodies are kept in the cache.
+    """
+    def __init__(self, encodings: List[str], mimetypes: List[str], min_size: int = 1024, cache_timeout: int = 60) -> None:
+        self.encodings: List[str] = [encoding for encoding in encodings if encoding in available_encodings()]
+        self.mimetypes: List[str] = mimetypes
+        self.min_size: int = min_size
+        self.cache_timeout: int = cache_timeout
+        self.lock: threading.Lock = threading.Lock()
+        self.statistics: Dict[str, Dict[str, float]] = {encoding: {'responses': 0, 'cache_hits': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_time': 0.0}
+                                                        for encoding in self.encodings}
+        self.skipped: Dict[str, int] = {'not_accepted': 0, 'mimetype': 0, 'too_small': 0, 'not_compressible': 0}
+
+    def negotiate(self, request: flask.Request) -> Optional[str]:
+        """
+        Select the encoding for a request from its Accept-Encoding header.
+
+        Args:
+            request (flask.Request): The request.
+
+        Returns:
+            Optional[str]: The encoding with the highest quality, ties are resolved by the order of `encodings`, or None.
+        """
+        best: Optional[str] = None
+        best_quality: float = 0
+        for encoding in self.encodings:
+            quality: float = request.accept_encodings.quality(encoding)
+            if quality > best_quality:
+                best = encoding
+                best_quality = quality
+        return best
+
+    def _count(self, reason: str) -> None:
+        with self.lock:
+            self.skipped[reason] += 1
+
+    def compress_response(self, response: flask.Response) -> flask.Response:
+        """
+        Compress a response if the request accepts a supported encoding and the response qualifies for compression.
+
+        Args:
+            response (flask.Response): The response.
+
+        Returns:
+            flask.Response: The response, compressed if applicable.
+        """
+        if response.status_code != 200 or response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+            return response
+        if response.mimetype not in self.mimetypes:
+            self._count('mimetype')
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding: Optional[str] = self.negotiate(flask.request)
+        if encoding is None:
+            self._count('not_accepted')
+            return response
+        data: bytes = response.get_data()
+        if len(data) < self.min_size:
+            self._count('too_small')
+            return response
+
+        digest: str = hashlib.sha1(data, usedforsecurity=False).hexdigest()
+        compressed: Optional[bytes] = get_compressed_body(digest, encoding)
+        if compressed is not None:
+            with self.lock:
+                self.statistics[encoding]['cache_hits'] += 1
+        else:
+            start: float = time.thread_time()
+            compressed = compress(data, encoding)
+            cpu_time: float = time.thread_time() - start
+            if len(compressed) >= len(data):
+                self._count('not_compressible')
+                return response
+            set_compressed_body(digest, encoding, compressed, timeout=self.cache_timeout)
+            with self.lock:
+                self.statistics[encoding]['cpu_time'] += cpu_time
+        with self.lock:
+            self.statistics[encoding]['responses'] += 1
+            self.statistics[encoding]['bytes_in'] += len(data)
+            self.statistics[encoding]['bytes_out'] += len(compressed)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        # The compressed body is a different representation, a strong ETag would claim it is byte-identical to the uncompressed one
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Returns per encoding the number of compressed responses, cache hits, bytes before and after compression, the compression ratio
+        and the CPU time spent compressing, and the number of responses that were not compressed by reason.
+
+        Returns:
+            Dict[str, Any]: The compression statistics.
+        """
+        with self.lock:
+            encodings: Dict[str, Dict[str, Any]] = {}
+            for encoding, statistics in self.statistics.items():
+                encodings[encoding] = dict(statistics)
+                encodings[encoding]['ratio'] = round(statistics['bytes_out'] / statistics['bytes_in'], 3) if statistics['bytes_in'] > 0 else None
+                encodings[encoding]['cpu_time'] = round(statistics['cpu_time'], 6)
+            return {'encodings': encodings, 'skipped': dict(self.skipped), 'min_size': self.min_size}
+
+    def after_request(self) -> Callable[[flask.Response], flask.Response]:
+        """
+        Returns a function to register with `after_request` that compresses the responses.
+
+        Returns:
+            Callable[[flask.Response], flask.Response]: The after request function.
+        """
+        def compress_after_request(response: flask.Response) -> flask.Response:
+            return self.compress_response(response)
+        return compress_after_request
@@ -0,0 +1,235 @@
+""" Federation of several CarConnectivity instances in one web UI"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import concurrent.futures
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import flask
+from flask_login import login_required
+
+from carconnectivity_plugins.webui.ui.formats import negotiate_format, as_native_dict, encode, FORMAT_MIMETYPES
+
+if TYPE_CHECKING:
+    from typing import Any, Dict, List, Optional, Tuple
+
+    from carconnectivity.carconnectivity import CarConnectivity
+
+LOG: logging.Logger = logging.getLogger("carconnectivity.plugins.webui")
+
+blueprint = flask.Blueprint(name='federation', import_name='federation', url_prefix='/federation')
+
+
+class RemoteInstance:  # pylint: disable=too-many-instance-attributes
+    """
+    A remote CarConnectivity instance whose garage is fetched through its web UI.
+
+    Each remote keeps its own HTTP session so connections are kept alive between fetches. The last successful snapshot is kept
+    and is revalidated with conditional requests (If-None-Match), so unchanged garages are not transferred again.
+
+    Args:
+        name (str): Name of the instance as shown in the web UI and used as key in the merged json.
+        url (str): Base URL of the web UI of the remote instance, e.g. http://192.168.0.10:4000
+        username (Optional[str]): Username for the remote web UI.
+        password (Optional[str]): Password for the remote web UI.
+        timeout (float): Timeout in seconds for connecting and for reading from the remote instance.
+        verify (bool): Verify the TLS certificate of the remote instance.
+    """
+    # pylint: disable-next=too-many-arguments, too-many-positional-arguments
+    def __init__(self, name: str, url: str, username: Optional[str] = None, password: Optional[str] = None, timeout: float = 10.0,
+                 verify: bool = True) -> None:
+        self.name: str = name
+        self.url: str = url.rstrip('/')
+        self.timeout: float = timeout
+        self.session: requests.Session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.verify = verify
+        if username is not None and password is not None:
+            self.session.auth = (username, password)
+        self.fetch_lock: threading.Lock = threading.Lock()
+        self.snapshot: Optional[Dict[str, Any]] = None
+        self.etag: Optional[str] = None
+        self.last_success: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.last_duration: Optional[float] = None
+        self.fetch_count: int = 0
+        self.not_modified_count: int = 0
+
+    def fetch(self) -> None:
+        """
+        Fetch the garage of the remote instance. Errors are recorded in `last_error`, the previous snapshot is kept in this case.
+        If a previous fetch of this remote is still running, nothing is done.
+        """
+        if not self.fetch_lock.acquire(blocking=False):  # pylint: disable=consider-using-with
+            return
+        start: float = time.monotonic()
+        try:
+            headers: Dict[str, str] = {'Accept': 'application/json'}
+            if self.etag is not None and self.snapshot is not None:
+                headers['If-None-Match'] = self.etag
+            response: requests.Response = self.session.get(f'{self.url}/garage/json', headers=headers, timeout=self.timeout)
+            self.fetch_count += 1
+            if response.status_code == requests.codes['not_modified']:
+                self.not_modified_count += 1
+            elif response.status_code == requests.codes['ok']:
+                self.snapshot = response.json()
+                self.etag = response.headers.get('ETag')
+            else:
+                raise requests.HTTPError(f'Unexpected status code {response.status_code}', response=response)
+            self.last_success = datetime.now(tz=timezone.utc)
+            self.last_error = None
+        except (requests.RequestException, ValueError) as err:
+            LOG.warning('Could not fetch garage from remote instance %s (%s): %s', self.name, self.url, err)
+            self.last_error = str(err)
+        finally:
+            self.last_duration = time.monotonic() - start
+            self.fetch_lock.release()
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Returns the fetch status of the remote instance.
+
+        Returns:
+            Dict[str, Any]: Dictionary with url, last success, last error, duration of the last fetch and fetch counters.
+        """
+        return {
+            'url': self.url,
+            'healthy': self.last_error is None and self.snapshot is not None,
+            'last_success': self.last_success.isoformat() if self.last_success is not None else None,
+            'last_error': self.last_error,
+            'last_duration': self.last_duration,
+            'fetch_count': self.fetch_count,
+            'not_modified_count': self.not_modified_count,
+        }
+
+    def close(self) -> None:
+        """
+        Close the connections to the remote instance.
+        """
+        self.session.close()
+
+
+class Federation:
+    """
+    Fetches the garages of several remote CarConnectivity instances concurrently in the background.
+
+    Requests to the web UI never wait for remote instances, they are served from the last snapshot of each remote.
+
+    Args:
+        remotes (List[RemoteInstance]): The remote instances.
+        interval (float): Interval in seconds in which the remote instances are fetched.
+    """
+    def __init__(self, remotes: List[RemoteInstance], interval: float = 30.0) -> None:
+        self.remotes: Dict[str, RemoteInstance] = {remote.name: remote for remote in remotes}
+        self.interval: float = interval
+        self.executor: concurrent.futures.ThreadPoolExecutor = \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max(len(remotes), 1), thread_name_prefix='carconnectivity.plugins.webui-federation')
+        self.stop_event: threading.Event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def fetch_all(self) -> None:
+        """
+        Fetch all remote instances in parallel and wait at most for the longest remote timeout.
+        Remotes that did not answer in time keep updating their snapshot in the background when they finally answer.
+        """
+        futures: List[concurrent.futures.Future] = [self.executor.submit(remote.fetch) for remote in self.remotes.values()]
+        if futures:
+            concurrent.futures.wait(futures, timeout=max(remote.timeout for remote in self.remotes.values()))
+
+    def start(self) -> None:
+        """
+        Start fetching the remote instances in the background.
+        """
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._loop, name='carconnectivity.plugins.webui-federation')
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop fetching and close all connections.
+        """
+        self.stop_event.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join()
+        self.thread = None
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for remote in self.remotes.values():
+            remote.close()
+
+    def _loop(self) -> None:
+        while not self.stop_event.is_set():
+            self.fetch_all()
+            self.stop_event.wait(self.interval)
+
+
+def _get_federation() -> Tuple[CarConnectivity, Federation]:
+    if 'car_connectivity' not in flask.current_app.extensions or flask.current_app.extensions['car_connectivity'] is None:
+        flask.abort(500, "car_connectivity instance not connected")
+    if flask.current_app.extensions.get('carconnectivity_federation') is None:
+        flask.abort(404, "Federation is not configured")
+    return flask.current_app.extensions['car_connectivity'], flask.current_app.extensions['carconnectivity_federation']
+
+
+@blueprint.route('/', methods=['GET'])
+@login_required
+def garage() -> str:
+    """
+    Render a garage view with the vehicles of this instance and all remote instances.
+
+    Returns:
+        Response: The rendered 'federation/garage.html' template.
+
+    Raises:
+        500: If the car_connectivity instance is not connected.
+        404: If no federation is configured.
+    """
+    car_connectivity, federation = _get_federation()
+    return flask.render_template('federation/garage.html', current_app=flask.current_app, garage=car_connectivity.garage,
+                                 remotes=federation.remotes.values())
+
+
+@blueprint.route('/json', methods=['GET'])
+@login_required
+def federation_json() -> flask.Response:
+    """
+    Return the garages of this instance (key "local") and of all remote instances (key is the name of the remote) merged in one document.
+    The fetch status of each remote is returned under the key "federation". Remotes that were never fetched successfully are omitted
+    from the garages, remotes that currently fail are returned with their last snapshot.
+    MessagePack or CBOR can be requested with the `Accept` header or the `format` query parameter.
+
+    Returns:
+        flask.Response: The merged garages.
+
+    Raises:
+        500: If the car_connectivity instance is not connected.
+        404: If no federation is configured.
+    """
+    car_connectivity, federation = _get_federation()
+    format_name: str = negotiate_format()
+    merged: Dict[str, Any] = {}
+    if format_name == 'json':
+        merged['local'] = json.loads(car_connectivity.garage.as_json())
+    else:
+        merged['local'] = as_native_dict(car_connectivity.garage)
+    for remote in federation.remotes.values():
+        if remote.snapshot is not None:
+            merged[remote.name] = remote.snapshot
+    merged['federation'] = {remote.name: remote.status() for remote in federation.remotes.values()}
+    if format_name == 'json':
+        pretty: bool = flask.request.args.get('pretty', default=False, type=bool)
+        response = flask.Response(json.dumps(merged, indent=4 if pretty else None), mimetype=FORMAT_MIMETYPES['json'][0])
+    else:
+        response = flask.Response(encode(merged, format_name), mimetype=FORMAT_MIMETYPES[format_name][0])
+    response.vary.add('Accept')
+    response.cache_control.max_age = 5
+    response.cache_control.private = True
+    response.cache_control.public = False
+    return response
@@ -0,0 +1,208 @@
+""" Response formats (JSON, MessagePack, CBOR) for the machine readable endpoints of the web UI"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+from enum import Enum
+from datetime import datetime, timedelta
+
+import flask
+
+from carconnectivity.attributes import GenericAttribute
+
+# pylint: disable=duplicate-code
+SUPPORT_IMAGES = False  # pylint: disable=invalid-name
+try:
+    from PIL import Image
+    SUPPORT_IMAGES = True  # pylint: disable=invalid-name
+except ImportError:
+    pass
+# pylint: enable=duplicate-code
+
+SUPPORT_MSGPACK = False  # pylint: disable=invalid-name
+try:
+    import msgpack
+    SUPPORT_MSGPACK = True  # pylint: disable=invalid-name
+except ImportError:
+    pass
+
+SUPPORT_CBOR = False  # pylint: disable=invalid-name
+try:
+    import cbor2
+    SUPPORT_CBOR = True  # pylint: disable=invalid-name
+except ImportError:
+    pass
+
+if TYPE_CHECKING:
+    from typing import Any, Dict, List, Optional, Union
+
+    from carconnectivity.objects import GenericObject
+
+# Mimetypes accepted for each format, the first one is used for responses
+FORMAT_MIMETYPES: Dict[str, List[str]] = {
+    'json': ['text/json', 'application/json'],
+    'msgpack': ['application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack'],
+    'cbor': ['application/cbor'],
+}
+
+
+def available_formats() -> List[str]:
+    """
+    Returns the response formats that can be produced with the installed libraries.
+
+    Returns:
+        List[str]: List of format names, 'json' is always available and always first.
+    """
+    formats: List[str] = ['json']
+    if SUPPORT_MSGPACK:
+        formats.append('msgpack')
+    if SUPPORT_CBOR:
+        formats.append('cbor')
+    return formats
+
+
+def negotiate_format() -> str:
+    """
+    Determine the response format for the current request.
+
+    An explicit `?format=` query parameter takes precedence over the `Accept` header. Without either
+    (or with a wildcard `Accept` header as sent by browsers) JSON is returned.
+
+    Returns:
+        str: The name of the negotiated format ('json', 'msgpack' or 'cbor').
+
+    Raises:
+        406: If the requested format is unknown or the library to produce it is not installed.
+    """
+    requested_format: Optional[str] = flask.request.args.get('format', default=None, type=str)
+    if requested_format is not None:
+        requested_format = requested_format.lower()
+        if requested_format not in FORMAT_MIMETYPES:
+            flask.abort(406, f"Unknown format {requested_format}, valid formats are {', '.join(FORMAT_MIMETYPES)}")
+        if requested_format not in available_formats():
+            flask.abort(406, f"Format {requested_format} is not available, the {requested_format} python module is not installed")
+        return requested_format
+    offered_mimetypes: List[str] = [mimetype for format_name in available_formats() for mimetype in FORMAT_MIMETYPES[format_name]]
+    best_match: Optional[str] = flask.request.accept_mimetypes.best_match(offered_mimetypes, default=offered_mimetypes[0])
+    for format_name, mimetypes in FORMAT_MIMETYPES.items():
+        if best_match in mimetypes:
+            return format_name
+    return 'json'
+
+
+def as_native_dict(element: Union[GenericObject, GenericAttribute], in_locale: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Convert an object tree to a dictionary with the same layout as `as_dict()`/`as_json()` of CarConnectivity,
+    but keeping native python values (e.g. datetime for the "upd" field) instead of their string representation.
+
+    Images are left out, just like in the JSON output.
+
+    Args:
+        element (Union[GenericObject, GenericAttribute]): The object or attribute to convert.
+        in_locale (Optional[str]): Locale to convert values and units to.
+
+    Returns:
+        Optional[Dict[str, Any]]: The dictionary representation or None if the element is filtered.
+    """
+    if isinstance(element, GenericAttribute):
+        value, unit = element.in_locale(in_locale)
+        if SUPPORT_IMAGES and isinstance(value, Image.Image):
+            return None
+        native_dict: Dict[str, Any] = {'val': value}
+        if element.last_updated is not None:
+            native_dict['upd'] = element.last_updated
+        if unit is not None:
+            native_dict['uni'] = unit
+        return native_dict
+    native_dict = {}
+    for child in element.children:
+        if child.enabled:
+            child_dict: Optional[Dict[str, Any]] = as_native_dict(child, in_locale)
+            if child_dict is not None:
+                native_dict[child.id] = child_dict
+    return native_dict
+
+
+def _native_value(value: Any) -> Any:
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, Enum):
+        return value.value
+    # Values of unknown types are sent as their string representation instead of silently being dropped
+    return str(value)
+
+
+def _msgpack_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.astimezone()
+        return msgpack.Timestamp.from_datetime(value)
+    return _native_value(value)
+
+
+def _cbor_default(encoder, value: Any) -> None:
+    encoder.encode(_native_value(value))
+
+
+def encode(data: Any, format_name: str) -> bytes:
+    """
+    Encode a native dictionary as returned by `as_native_dict` in a binary format.
+
+    Timestamps are encoded with the native timestamp types of the format (MessagePack timestamp extension,
+    CBOR epoch-based date/time tag), binary data such as images is stored as native byte strings. Values without a native
+    representation in the format are encoded as strings.
+
+    Args:
+        data (Any): The data to encode.
+        format_name (str): 'msgpack' or 'cbor'.
+
+    Returns:
+        bytes: The encoded data.
+    """
+    if format_name == 'msgpack':
+        return msgpack.packb(data, default=_msgpack_default, use_bin_type=True)
+    if format_name == 'cbor':
+        return cbor2.dumps(data, default=_cbor_default, datetime_as_timestamp=True, timezone=datetime.now().astimezone().tzinfo)
+    raise ValueError(f'Unknown binary format {format_name}')
+
+
+def decode(data: bytes, format_name: str) -> Any:
+    """
+    Decode data produced by `encode`. Timestamps are decoded to timezone aware datetime objects.
+
+    Args:
+        data (bytes): The encoded data.
+        format_name (str): 'msgpack' or 'cbor'.
+
+    Returns:
+        Any: The decoded data.
+    """
+    if format_name == 'msgpack':
+        return msgpack.unpackb(data, timestamp=3, raw=False)
+    if format_name == 'cbor':
+        return cbor2.loads(data)
+    raise ValueError(f'Unknown binary format {format_name}')
+
+
+def element_response(element: Union[GenericObject, GenericAttribute], format_name: str, pretty: bool = False,
+                     in_locale: Optional[str] = None) -> flask.Response:
+    """
+    Build a response for an object tree in the given format.
+
+    Args:
+        element (Union[GenericObject, GenericAttribute]): The object tree to return.
+        format_name (str): The format as returned by `negotiate_format`.
+        pretty (bool): Indent the output, only used for JSON.
+        in_locale (Optional[str]): Locale to convert values and units to.
+
+    The response carries an ETag, so clients can revalidate with If-None-Match.
+
+    Returns:
+        flask.Response: The response with the encoded object tree.
+    """
+    if format_name == 'json':
+        response = flask.Response(element.as_json(pretty=pretty, in_locale=in_locale), mimetype=FORMAT_MIMETYPES['json'][0])
+    else:
+        response = flask.Response(encode(as_native_dict(element, in_locale=in_locale), format_name), mimetype=FORMAT_MIMETYPES[format_name][0])
+    response.vary.add('Accept')
+    response.add_etag()
+    return response
@@ -8,8 +8,12 @@ from base64 import b64encode
 
 import flask
 from flask_login import login_required
+from werkzeug.http import generate_etag
 
-from carconnectivity_plugins.webui.ui.cache import cache
+from carconnectivity_plugins.webui.ui.cache import cache, cacheable_response, make_cache_key
+from carconnectivity_plugins.webui.ui.formats import negotiate_format, element_response, encode, FORMAT_MIMETYPES
+from carconnectivity_plugins.webui.ui.snapshot import stale_response
+from carconnectivity_plugins.webui.ui.vehicle_index import INDEX_FIELDS
 
 # pylint: disable=duplicate-code
 SUPPORT_IMAGES = False  # pylint: disable=invalid-name
@@ -21,15 +25,66 @@ except ImportError:
 # pylint: enable=duplicate-code
 
 if TYPE_CHECKING:
-    from typing import Optional, Dict
+    from typing import Any, Optional, Dict, Union, List, Tuple
+
+    from datetime import datetime
 
     from werkzeug import Response
 
+    from carconnectivity.attributes import GenericAttribute
     from carconnectivity.carconnectivity import CarConnectivity
+    from carconnectivity.objects import GenericObject
     from carconnectivity.vehicle import GenericVehicle
 
+    from carconnectivity_plugins.webui.ui.snapshot import SnapshotStore
+    from carconnectivity_plugins.webui.ui.vehicle_index import VehicleIndex
+
 blueprint = flask.Blueprint(name='garage', import_name='garage', url_prefix='/garage')
 
+# Sections (tabs) of the vehicle page: section name -> (title, attribute of the vehicle holding the section, None for the vehicle itself)
+VEHICLE_SECTIONS: Dict[str, Tuple[str, Optional[str]]] = {
+    'vehicle': ('Vehicle', None),
+    'specification': ('Specification', 'specification'),
+    'software': ('Software', 'software'),
+    'drives': ('Drives', 'drives'),
+    'doors': ('Doors', 'doors'),
+    'windows': ('Windows', 'windows'),
+    'lights': ('Lights', 'lights'),
+    'charging': ('Charging', 'charging'),
+    'climatization': ('Climatization', 'climatization'),
+    'window_heating': ('Window Heating', 'window_heatings'),
+    'maintenance': ('Maintenance', 'maintenance'),
+    'position': ('Position', 'position'),
+}
+
+# Fields of each vehicle in the compact garage listing (/garage/list/json)
+LISTING_FIELDS: List[str] = ['vin', 'name', 'license_plate', 'model', 'level', 'range', 'range_unit', 'odometer', 'odometer_unit']
+
+# Number of vehicles per page of the garage page and maximum number of vehicles per request of the garage listing
+GARAGE_PAGE_SIZE: int = 24
+GARAGE_MAX_PAGE_SIZE: int = 200
+
+# Children of the vehicle that are not shown in the vehicle section as they have their own section
+VEHICLE_SECTION_EXCLUDE: List[str] = ['images', 'commands', 'specification', 'software', 'doors', 'windows', 'lights', 'drives', 'charging',
+                                      'climatization', 'window_heating', 'maintenance', 'position']
+
+
+def _get_vehicle_index() -> Tuple[CarConnectivity, VehicleIndex]:
+    if 'car_connectivity' not in flask.current_app.extensions or flask.current_app.extensions['car_connectivity'] is None:
+        flask.abort(500, "car_connectivity instance not connected")
+    return flask.current_app.extensions['car_connectivity'], flask.current_app.extensions['carconnectivity_vehicle_index']
+
+
+def _listing_arguments() -> Tuple[Optional[str], str, bool]:
+    search: Optional[str] = flask.request.args.get('q', default=None, type=str)
+    sort: str = flask.request.args.get('sort', default='name', type=str)
+    if sort not in INDEX_FIELDS:
+        flask.abort(400, f"Unknown sort field {sort}, must be one of {', '.join(INDEX_FIELDS)}")
+    order: str = flask.request.args.get('order', default='asc', type=str)
+    if order not in ('asc', 'desc'):
+        flask.abort(400, "Unknown order, must be asc or desc")
+    return search, sort, order == 'desc'
+
 
 @blueprint.route('/', methods=['GET'])
 @login_required
@@ -37,31 +92,135 @@ def garage() -> str:
     """
     Renders the garage page if the car_connectivity instance is connected.
 
-    This function checks if the 'car_connectivity' extension is present and connected
-    in the current Flask application context. If not, it aborts with a 500 status code.
-    If the extension is connected, it retrieves the CarConnectivity instance and renders
-    the 'garage/garage.html' template with the current application context and the garage
-    data from the CarConnectivity instance.
+    The vehicles are searched, sorted and paginated on the server with the query parameters `q` (search in VIN, name, license plate
+    and model), `sort` (vin, name, license_plate or model), `order` (asc or desc), `page` and `per_page`, so only the vehicles of
+    one page are rendered. With JavaScript the page switches to a virtualized list that fetches the visible vehicles from
+    `garage_list_json`. After a restart, until all connectors fetched their data, the vehicles of the last persisted snapshot that
+    are not in the garage yet are shown and marked as stale.
 
     Returns:
         Response: The rendered 'garage/garage.html' template.
 
     Raises:
-        HTTPException: If the 'car_connectivity' extension is not present or not connected.
+        HTTPException: If the 'car_connectivity' extension is not present or not connected or the listing arguments are invalid.
     """
-    if 'car_connectivity' not in flask.current_app.extensions or flask.current_app.extensions['car_connectivity'] is None:
-        flask.abort(500, "car_connectivity instance not connected")
-    car_connectivity: CarConnectivity = flask.current_app.extensions['car_connectivity']
-    return flask.render_template('garage/garage.html', current_app=flask.current_app, garage=car_connectivity.garage)
+    _, vehicle_index = _get_vehicle_index()
+    search, sort, descending = _listing_arguments()
+    per_page: int = min(max(flask.request.args.get('per_page', default=GARAGE_PAGE_SIZE, type=int), 1), GARAGE_MAX_PAGE_SIZE)
+    page: int = max(flask.request.args.get('page', default=1, type=int), 1)
+    total, vins = vehicle_index.query(search=search, sort=sort, descending=descending, offset=(page - 1) * per_page, limit=per_page)
+    vehicles: List[GenericVehicle] = [vehicle_obj for vehicle_obj in (vehicle_index.get_vehicle(vin) for vin in vins) if vehicle_obj is not None]
+    stale_vehicles: Optional[Dict[str, Any]] = None
+    stale_since: Optional[datetime] = None
+    snapshot_store: Optional[SnapshotStore] = flask.current_app.extensions.get('carconnectivity_snapshot')
+    if snapshot_store is not None and not search:
+        snapshot_entry: Optional[Tuple[bytes, str]] = snapshot_store.get('garage/json')
+        if snapshot_entry is not None:
+            # Vehicles of connectors that did not fetch their data yet are shown from the snapshot next to the live vehicles
+            stale_vehicles = {vin: vehicle for vin, vehicle in json.loads(snapshot_entry[0]).items() if vehicle_index.get_vehicle(vin) is None}
+            stale_since = snapshot_store.created
+    return flask.render_template('garage/garage.html', current_app=flask.current_app, vehicles=vehicles, total=total, page=page,
+                                 per_page=per_page, pages=max((total + per_page - 1) // per_page, 1), search=search, sort=sort,
+                                 order='desc' if descending else 'asc', sort_fields=INDEX_FIELDS, stale_vehicles=stale_vehicles,
+                                 stale_since=stale_since)
+
+
+def listing_value(attribute: GenericAttribute, locale: Optional[str]) -> Tuple[Optional[Any], Optional[str]]:
+    """
+    Returns the value of a numeric attribute converted to the locale and rounded to its precision, as shown by format_cc_element.
+
+    Args:
+        attribute (GenericAttribute): The attribute.
+        locale (Optional[str]): The locale of the web UI.
+
+    Returns:
+        Tuple[Optional[Any], Optional[str]]: The value and the unit, both None if the attribute is disabled.
+    """
+    if not attribute.enabled:
+        return None, None
+    value, unit = attribute.in_locale(locale=locale)
+    precision: Optional[float] = getattr(attribute, 'precision', None)
+    if value is not None and precision is not None:
+        precision_digits: int = 0
+        while precision < 1:
+            precision_digits += 1
+            precision *= 10
+        value = round(value, precision_digits)
+    return value, str(unit) if unit is not None else None
+
+
+def vehicle_listing(vehicle_obj: GenericVehicle, locale: Optional[str] = None) -> List[Any]:
+    """
+    Returns the compact representation of a vehicle in the garage listing, the values are in the order of LISTING_FIELDS.
+    Range and odometer are converted to the locale and rounded like on the server rendered garage page.
+
+    Args:
+        vehicle_obj (GenericVehicle): The vehicle.
+        locale (Optional[str]): The locale of the web UI.
+
+    Returns:
+        List[Any]: The values of the listing fields.
+    """
+    levels: Optional[List[Optional[float]]] = None
+    if vehicle_obj.drives.enabled and len(vehicle_obj.drives.drives) > 0:
+        levels = [listing_value(drive.level, locale)[0] for drive in vehicle_obj.drives.drives.values()]
+    total_range, range_unit = listing_value(vehicle_obj.drives.total_range, locale)
+    odometer, odometer_unit = listing_value(vehicle_obj.odometer, locale)
+    return [vehicle_obj.vin.value,
+            vehicle_obj.name.value if vehicle_obj.name.enabled else None,
+            vehicle_obj.license_plate.value if vehicle_obj.license_plate.enabled else None,
+            vehicle_obj.model.value if vehicle_obj.model.enabled else None,
+            levels, total_range, range_unit, odometer, odometer_unit]
+
+
+@blueprint.route('/list/json', methods=['GET'])
+@login_required
+@cache.cached(timeout=5, make_cache_key=make_cache_key)
+def garage_list_json() -> flask.Response:
+    """
+    Return a compact, paginated listing of the vehicles in the garage.
+
+    The vehicles are filtered and sorted with the query parameters `q`, `sort` and `order` as on the garage page and paginated with
+    `offset` and `limit` (at most GARAGE_MAX_PAGE_SIZE). Each vehicle is a list of values in the order of the `fields` list of the
+    response. MessagePack or CBOR can be requested with the `Accept` header or the `format` query parameter.
+
+    Returns:
+        flask.Response: The listing with `total`, `offset`, `fields` and `vehicles` and cache control headers (max_age=5, private).
+
+    Raises:
+        500: If the car_connectivity instance is not connected or available.
+        400: If the listing arguments are invalid.
+    """
+    _, vehicle_index = _get_vehicle_index()
+    search, sort, descending = _listing_arguments()
+    offset: int = max(flask.request.args.get('offset', default=0, type=int), 0)
+    limit: int = min(max(flask.request.args.get('limit', default=GARAGE_PAGE_SIZE, type=int), 1), GARAGE_MAX_PAGE_SIZE)
+    format_name: str = negotiate_format()
+    total, vins = vehicle_index.query(search=search, sort=sort, descending=descending, offset=offset, limit=limit)
+    locale: Optional[str] = flask.current_app.extensions.get('carconnectivity_locale')
+    listing: Dict[str, Any] = {'total': total, 'offset': offset, 'fields': LISTING_FIELDS,
+                               'vehicles': [vehicle_listing(vehicle_obj, locale) for vehicle_obj in (vehicle_index.get_vehicle(vin) for vin in vins)
+                                            if vehicle_obj is not None]}
+    if format_name == 'json':
+        response = flask.Response(json.dumps(listing, separators=(',', ':')), mimetype=FORMAT_MIMETYPES['json'][0])
+    else:
+        response = flask.Response(encode(listing, format_name), mimetype=FORMAT_MIMETYPES[format_name][0])
+    response.vary.add('Accept')
+    response.add_etag()
+    response.cache_control.max_age = 5
+    response.cache_control.private = True
+    response.cache_control.public = False
+    return response
 
 
 @blueprint.route('/json', methods=['GET'])
-@cache.cached(timeout=5)
 @login_required
+@cache.cached(timeout=5, make_cache_key=make_cache_key, response_filter=cacheable_response)
 def garage_json() -> flask.Response:
     """
     Retrieve the garage data as a JSON response.
     This endpoint returns the current state of all vehicles in the garage as JSON.
+    MessagePack or CBOR can be requested with the `Accept` header or the `format` query parameter.
     The response includes cache control headers to allow private caching for 5 seconds.
     Returns:
         flask.Response: A Flask response object containing the garage data in JSON format
@@ -80,6 +239,9 @@ def garage_json() -> flask.Response:
     car_connectivity: CarConnectivity = flask.current_app.extensions['car_connectivity']
     if car_connectivity.garage is None:
         flask.abort(404, "Garage not found")
+    snapshot_response: Optional[flask.Response] = stale_response('garage/json')
+    if snapshot_response is not None:
+        return snapshot_response
     pretty: bool = flask.request.args.get('pretty', default=False, type=bool)
     in_locale: bool = flask.request.args.get('in_locale', default=False, type=bool)
     with_locale: Optional[str] = flask.request.args.get('with_locale', default=None, type=str)
@@ -90,8 +252,7 @@ def garage_json() -> flask.Response:
         with_local_str = car_connectivity.connectors.connectors['webui'].active_config['locale']
     else:
         with_local_str = None
-    vehicle_json_str: str = car_connectivity.garage.as_json(pretty=pretty, in_locale=with_local_str)
-    response = flask.Response(vehicle_json_str, mimetype="text/json")
+    response = element_response(car_connectivity.garage, negotiate_format(), pretty=pretty, in_locale=with_local_str)
     response.cache_control.max_age = 5
     response.cache_control.private = True
     response.cache_control.public = False
@@ -99,24 +260,45 @@ def garage_json() -> flask.Response:
     # pylint: enable=duplicate-code
 
 
+def get_vehicle_section(vehicle_obj: GenericVehicle, section: str) -> Optional[GenericObject]:
+    """
+    Returns the object that is shown in a section of the vehicle page.
+
+    Args:
+        vehicle_obj (GenericVehicle): The vehicle.
+        section (str): The name of the section as used in VEHICLE_SECTIONS.
+
+    Returns:
+        Optional[GenericObject]: The object of the section or None if the section is unknown, not available for this vehicle or disabled.
+    """
+    if section not in VEHICLE_SECTIONS:
+        return None
+    attribute: Optional[str] = VEHICLE_SECTIONS[section][1]
+    if attribute is None:
+        return vehicle_obj
+    element: Optional[GenericObject] = getattr(vehicle_obj, attribute, None)
+    if element is None or not element.enabled:
+        return None
+    return element
+
+
 @blueprint.route('/<string:vin>/', methods=['GET'])
 @login_required
 def vehicle(vin: str) -> str:
     """
-    Render the garage template for a vehicle.
+    Render the page for a vehicle.
 
-    This function checks if the 'car_connectivity' extension is available in the current Flask application context.
-    If the extension is not available or not connected, it aborts the request with a 500 status code.
-    Otherwise, it retrieves the CarConnectivity instance and renders the 'garage/garage.html' template.
+    Only the first section (the vehicle overview) is rendered with the page. All other sections are listed as tabs and
+    are fetched from `vehicle_section` when the tab is activated.
 
     Args:
         vin (str): The Vehicle Identification Number of the vehicle.
 
     Returns:
-        Response: The rendered 'garage/garage.html' template with the current application context and garage data.
+        Response: The rendered 'garage/vehicle.html' template.
 
     Raises:
-        HTTPException: If the 'car_connectivity' extension is not available or not connected.
+        HTTPException: If the 'car_connectivity' extension is not available or not connected or the vehicle is not found.
     """
     if 'car_connectivity' not in flask.current_app.extensions or flask.current_app.extensions['car_connectivity'] is None:
         flask.abort(500, "car_connectivity instance not connected")
@@ -124,19 +306,58 @@ def vehicle(vin: str) -> str:
     vehicle_obj: Optional[GenericVehicle] = car_connectivity.garage.get_vehicle(vin)
     if vehicle_obj is None:
         flask.abort(404, f"Vehicle with VIN {vin} not found")
-    return flask.render_template('garage/vehicle.html', current_app=flask.current_app, vehicle=vehicle_obj)
+    sections: List[Tuple[str, str]] = [(section, title) for section, (title, _) in VEHICLE_SECTIONS.items()
+                                       if get_vehicle_section(vehicle_obj, section) is not None]
+    return flask.render_template('garage/vehicle.html', current_app=flask.current_app, vehicle=vehicle_obj, sections=sections,
+                                 element=vehicle_obj, exclude=VEHICLE_SECTION_EXCLUDE)
+
+
+@blueprint.route('/<string:vin>/section/<string:section>', methods=['GET'])
+@login_required
+@cache.cached(timeout=5)
+def vehicle_section(vin: str, section: str) -> flask.Response:
+    """
+    Render a single section (tab) of the vehicle page as HTML fragment.
+
+    Args:
+        vin (str): The Vehicle Identification Number of the vehicle.
+        section (str): The name of the section as used in VEHICLE_SECTIONS.
+
+    Returns:
+        flask.Response: The rendered 'garage/section.html' template with cache control headers (max_age=5, private).
+
+    Raises:
+        500: If the car_connectivity instance is not connected or available.
+        404: If the vehicle or the section is not found.
+    """
+    if 'car_connectivity' not in flask.current_app.extensions or flask.current_app.extensions['car_connectivity'] is None:
+        flask.abort(500, "car_connectivity instance not connected")
+    car_connectivity: CarConnectivity = flask.current_app.extensions['car_connectivity']
+    vehicle_obj: Optional[GenericVehicle] = car_connectivity.garage.get_vehicle(vin)
+    if vehicle_obj is None:
+        flask.abort(404, f"Vehicle with VIN {vin} not found")
+    element: Optional[GenericObject] = get_vehicle_section(vehicle_obj, section)
+    if element is None:
+        flask.abort(404, f"Section {section} not found for vehicle with VIN {vin}")
+    exclude: List[str] = VEHICLE_SECTION_EXCLUDE if element is vehicle_obj else ['commands']
+    response = flask.Response(flask.render_template('garage/section.html', element=element, exclude=exclude), mimetype='text/html')
+    response.cache_control.max_age = 5
+    response.cache_control.private = True
+    response.cache_control.public = False
+    return response
 
 
 @blueprint.route('/<string:vin>-car.png', defaults={'conversion': None}, methods=['GET'])
 @blueprint.route('/<string:vin>-car.png<string:conversion>', methods=['GET'])
 @login_required
-def vehicle_img(vin: str, conversion: Optional[str]) -> Response:
+def vehicle_img(vin: str, conversion: Optional[str]) -> Response:  # pylint: disable=too-many-return-statements
     """
     Retrieves the image of a vehicle based on its VIN (Vehicle Identification Number).
 
     Args:
         vin (str): The Vehicle Identification Number of the vehicle.
-        conversion (Optional[str]): The desired format for the response. If '.json', the image will be returned as a base64-encoded JSON object.
+        conversion (Optional[str]): The desired format for the response. If '.json', the image will be returned as a base64-encoded JSON object
+        or, if MessagePack or CBOR is negotiated, as an object with the PNG data as native binary field.
         Otherwise, the image will be returned as a PNG file.
 
     Returns:
@@ -151,6 +372,9 @@ def vehicle_img(vin: str, conversion: Optional[str]) -> Response:
     car_connectivity: CarConnectivity = flask.current_app.extensions['car_connectivity']
     vehicle_obj: Optional[GenericVehicle] = car_connectivity.garage.get_vehicle(vin)
     if vehicle_obj is None:
+        snapshot_response: Optional[flask.Response] = stale_response(f'garage/{vin}-car.png') if conversion is None else None
+        if snapshot_response is not None:
+            return snapshot_response
         if 'fallback' in flask.request.args:
             return flask.redirect(flask.url_for('static', filename=flask.request.args.get('fallback')))
         flask.abort(404, f"Vehicle with VIN {vin} not found")
@@ -169,20 +393,31 @@ def vehicle_img(vin: str, conversion: Optional[str]) -> Response:
         vehicle_obj.images.images['car_picture'].value.save(img_io, 'PNG')
         img_io.seek(0)
         if conversion == '.json':
+            format_name: str = negotiate_format()
+            if format_name != 'json':
+                binary_map: Dict[str, Union[str, bytes]] = {'type': 'image/png', 'encoding': 'binary', 'data': img_io.read()}
+                response: Response = flask.Response(encode(binary_map, format_name), mimetype=FORMAT_MIMETYPES[format_name][0])
+                response.vary.add('Accept')
+                response.add_etag()
+                return response
             json_map: Dict[str, str] = {}
             json_map['type'] = 'image/png'
             json_map['encoding'] = 'base64'
             json_map['data'] = b64encode(img_io.read()).decode()
-            return flask.Response(json.dumps(json_map), mimetype='application/json')
-        return flask.send_file(img_io, mimetype='image/png')
+            response = flask.Response(json.dumps(json_map), mimetype='application/json')
+            response.vary.add('Accept')
+            response.add_etag()
+            return response
+        return flask.send_file(img_io, mimetype='image/png', etag=generate_etag(img_io.getvalue()))
 
 
 @blueprint.route('/<string:vin>/json', methods=['GET'])
-@cache.cached(timeout=5)
 @login_required
+@cache.cached(timeout=5, make_cache_key=make_cache_key, response_filter=cacheable_response)
 def vehicle_json(vin: str) -> flask.Response:
     """
     Generate a JSON response containing the vehicle data for a given VIN.
+    MessagePack or CBOR can be requested with the `Accept` header or the `format` query parameter.
     Args:
         vin (str): The Vehicle Identification Number of the vehicle to retrieve.
     Returns:
@@ -198,6 +433,9 @@ def vehicle_json(vin: str) -> flask.Response:
     car_connectivity: CarConnectivity = flask.current_app.extensions['car_connectivity']
     vehicle_obj: Optional[GenericVehicle] = car_connectivity.garage.get_vehicle(vin)
     if vehicle_obj is None:
+        snapshot_response: Optional[flask.Response] = stale_response(f'garage/{vin}/json')
+        if snapshot_response is not None:
+            return snapshot_response
         flask.abort(404, f"Vehicle with VIN {vin} not found")
     pretty: bool = flask.request.args.get('pretty', default=False, type=bool)
     in_locale: bool = flask.request.args.get('in_locale', default=False, type=bool)
@@ -210,8 +448,7 @@ def vehicle_json(vin: str) -> flask.Response:
     else:
         with_local_str = None
 
-    vehicle_json_str: str = vehicle_obj.as_json(pretty=pretty, in_locale=with_local_str)
-    response = flask.Response(vehicle_json_str, mimetype="text/json")
+    response = element_response(vehicle_obj, negotiate_format(), pretty=pretty, in_locale=with_local_str)
     response.cache_control.max_age = 5
     response.cache_control.private = True
     response.cache_control.public = False
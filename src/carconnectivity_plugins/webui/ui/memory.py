@@ -0,0 +1,335 @@
+""" Memory introspection and memory budgets for the web UI"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import gc
+import logging
+import sys
+import threading
+import tracemalloc
+
+from carconnectivity_plugins.webui.ui.cache import cache
+
+SUPPORT_RESOURCE = False  # pylint: disable=invalid-name
+try:
+    import resource
+    SUPPORT_RESOURCE = True  # pylint: disable=invalid-name
+except ImportError:
+    pass
+
+if TYPE_CHECKING:
+    from typing import Any, Dict, List, Optional, Tuple
+
+    from carconnectivity.carconnectivity import CarConnectivity
+    from carconnectivity.util import LogMemoryHandler
+
+LOG: logging.Logger = logging.getLogger("carconnectivity.plugins.webui")
+
+MEGABYTE: int = 1024 * 1024
+
+# Structures with a memory budget, rss is the resident memory of the whole process
+BUDGETS: List[str] = ['cache', 'logs', 'rss']
+
+# After an eviction for the rss budget, the next one happens only after rss fell below this fraction of the budget
+RSS_LOW_WATER: float = 0.9
+
+
+def current_rss() -> Optional[int]:
+    """
+    Returns the resident set size of the process in bytes. Where /proc is not available, the peak resident set size is returned.
+
+    Returns:
+        Optional[int]: The resident set size in bytes or None if it cannot be determined.
+    """
+    try:
+        with open('/proc/self/status', encoding='utf-8') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if not SUPPORT_RESOURCE:
+        return None
+    maxrss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def log_record_size(record: logging.LogRecord) -> int:
+    """
+    Approximate memory held by a log record: the record, its attributes, the message and the arguments.
+
+    Args:
+        record (logging.LogRecord): The log record.
+
+    Returns:
+        int: The approximate size in bytes.
+    """
+    size: int = sys.getsizeof(record) + sys.getsizeof(record.__dict__) + sys.getsizeof(record.msg)
+    if isinstance(record.args, tuple):
+        size += sum(sys.getsizeof(arg) for arg in record.args)
+    if record.exc_text is not None:
+        size += sys.getsizeof(record.exc_text)
+    return size
+
+
+class MemoryMonitor:  # pylint: disable=too-many-instance-attributes
+    """
+    Measures the data held by the web UI and evicts data when configured budgets are exceeded.
+
+    Measured are the entries of the view cache (including cached compressed bodies), the log records of CarConnectivity, all
+    connectors and plugins (including the web server access log), the vehicle images and the threads of the process. Budgets
+    can be set for the cache, the logs and the resident memory of the process. When the cache or the logs exceed their budget,
+    the oldest entries are evicted. When the process exceeds its resident memory budget, the cache is cleared, the logs are cut
+    in half and a garbage collection is run. This happens again only after the resident memory fell below RSS_LOW_WATER of the
+    budget. Vehicle images belong to the connectors and are only reported.
+
+    tracemalloc can be started on demand to find the allocations that grow between two snapshots.
+
+    Args:
+        car_connectivity (CarConnectivity): The CarConnectivity instance.
+        budgets (Dict[str, Optional[int]]): Budget in bytes per structure in BUDGETS, None for no budget.
+        interval (float): Interval in seconds in which the budgets are checked.
+    """
+    def __init__(self, car_connectivity: CarConnectivity, budgets: Optional[Dict[str, Optional[int]]] = None, interval: float = 30.0) -> None:
+        self.car_connectivity: CarConnectivity = car_connectivity
+        self.budgets: Dict[str, Optional[int]] = {budget: None for budget in BUDGETS}
+        if budgets is not None:
+            self.budgets.update(budgets)
+        self.interval: float = interval
+        self.lock: threading.Lock = threading.Lock()
+        self.stop_event: threading.Event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.evictions: Dict[str, int] = {budget: 0 for budget in BUDGETS}
+        self.evicted_bytes: Dict[str, int] = {budget: 0 for budget in BUDGETS}
+        self.tracemalloc_snapshot: Optional[tracemalloc.Snapshot] = None
+        # tracemalloc may also be started outside of the web UI, e.g. with PYTHONTRACEMALLOC, then it is left running
+        self.tracemalloc_started: bool = False
+        self.rss_evicted: bool = False
+
+    def _log_storages(self) -> Dict[str, LogMemoryHandler]:
+        storages: Dict[str, LogMemoryHandler] = {'carconnectivity': self.car_connectivity.log_storage}
+        for connector_id, connector in list(self.car_connectivity.connectors.connectors.items()):
+            storages[f'connector:{connector_id}'] = connector.log_storage
+            if getattr(connector, 'api_log_storage', None) is not None:
+                storages[f'connector:{connector_id}:api'] = connector.api_log_storage
+        for plugin_id, plugin in list(self.car_connectivity.plugins.plugins.items()):
+            storages[f'plugin:{plugin_id}'] = plugin.log_storage
+        return storages
+
+    @staticmethod
+    def cache_usage() -> Tuple[int, int]:
+        """
+        Returns the number of entries and the approximate size in bytes of the view cache.
+
+        Returns:
+            Tuple[int, int]: Number of entries and size in bytes.
+        """
+        entries: Dict[str, Any] = getattr(cache.cache, '_cache', {})
+        size: int = 0
+        for key, (_, value) in list(entries.items()):
+            size += sys.getsizeof(key) + (len(value) if isinstance(value, (bytes, bytearray)) else sys.getsizeof(value))
+        return len(entries), size
+
+    def log_usage(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns the number of records, the capacity and the approximate size in bytes of each log storage.
+
+        Returns:
+            Dict[str, Dict[str, int]]: Usage per log storage.
+        """
+        return {name: {'records': len(storage.storage), 'capacity': storage.capacity,
+                       'bytes': sum(log_record_size(record) for record in list(storage.storage))} for name, storage in self._log_storages().items()}
+
+    def image_usage(self) -> Dict[str, Any]:
+        """
+        Returns the number of vehicle images and the memory of their decoded pixel data.
+
+        Returns:
+            Dict[str, Any]: Number of images and size in bytes.
+        """
+        count: int = 0
+        size: int = 0
+        for vehicle in self.car_connectivity.garage.list_vehicles():
+            for image in vehicle.images.images.values():
+                if image.enabled and image.value is not None:
+                    count += 1
+                    size += image.value.width * image.value.height * len(image.value.getbands())
+        return {'images': count, 'bytes': size}
+
+    @staticmethod
+    def thread_usage() -> Dict[str, Any]:
+        """
+        Returns the number of threads of the process grouped by name without the trailing counter.
+
+        Returns:
+            Dict[str, Any]: Total number of threads and threads per name.
+        """
+        threads: Dict[str, int] = {}
+        for thread in threading.enumerate():
+            name: str = thread.name.split(' (')[-1].rstrip(')') if thread.name.startswith('Thread-') else thread.name
+            threads[name] = threads.get(name, 0) + 1
+        return {'threads': threading.active_count(), 'by_name': threads}
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Returns the measured usage, the budgets and the evictions.
+
+        Returns:
+            Dict[str, Any]: The memory status.
+        """
+        cache_entries, cache_bytes = self.cache_usage()
+        logs: Dict[str, Dict[str, int]] = self.log_usage()
+        return {
+            'rss': current_rss(),
+            'cache': {'entries': cache_entries, 'bytes': cache_bytes},
+            'logs': {'bytes': sum(usage['bytes'] for usage in logs.values()), 'storages': logs},
+            'images': self.image_usage(),
+            'threads': self.thread_usage(),
+            'gc': {'objects': len(gc.get_objects()), 'counts': gc.get_count()},
+            'budgets': dict(self.budgets),
+            'evictions': dict(self.evictions),
+            'evicted_bytes': dict(self.evicted_bytes),
+            'rss_evicted': self.rss_evicted,
+            'tracemalloc': tracemalloc.is_tracing(),
+        }
+
+    def _evict_cache(self, budget: int) -> int:
+        backend: Any = cache.cache
+        entries: Optional[Dict[str, Any]] = getattr(backend, '_cache', None)
+        if entries is None:
+            return 0
+        _, size = self.cache_usage()
+        evicted: int = 0
+        with backend._lock:  # pylint: disable=protected-access
+            # Entries expiring first are evicted first, they are the oldest. Entries that never expire (0) are evicted last
+            for key, (_, value) in sorted(list(entries.items()), key=lambda item: (item[1][0] == 0, item[1][0])):
+                if size - evicted <= budget:
+                    break
+                entries.pop(key, None)
+                evicted += sys.getsizeof(key) + (len(value) if isinstance(value, (bytes, bytearray)) else sys.getsizeof(value))
+        return evicted
+
+    def _evict_logs(self, budget: int) -> int:
+        storages: List[LogMemoryHandler] = list(self._log_storages().values())
+        sizes: Dict[int, int] = {id(storage): sum(log_record_size(record) for record in list(storage.storage)) for storage in storages}
+        evicted: int = 0
+        # Drop the oldest records of the largest storage until the logs are within budget
+        while sum(sizes.values()) > budget:
+            storage: LogMemoryHandler = max(storages, key=lambda storage: sizes[id(storage)])
+            if len(storage.storage) == 0:
+                break
+            record_size: int = log_record_size(storage.storage.popleft())  # type: ignore[attr-defined]
+            sizes[id(storage)] -= record_size
+            evicted += record_size
+        return evicted
+
+    def _record_eviction(self, budget: str, evicted: int) -> None:
+        if evicted > 0:
+            self.evictions[budget] += 1
+            self.evicted_bytes[budget] += evicted
+            LOG.info('Memory budget for %s exceeded, evicted %d bytes', budget, evicted)
+
+    def enforce_budgets(self) -> None:
+        """
+        Check the budgets and evict data from structures exceeding their budget.
+        """
+        with self.lock:
+            if self.budgets['cache'] is not None:
+                self._record_eviction('cache', self._evict_cache(self.budgets['cache']))
+            if self.budgets['logs'] is not None:
+                self._record_eviction('logs', self._evict_logs(self.budgets['logs']))
+            rss: Optional[int] = current_rss()
+            if self.budgets['rss'] is None or rss is None:
+                return
+            if self.rss_evicted:
+                # Freed memory is rarely returned to the operating system, evicting again while rss stays high would drain the logs
+                if rss < self.budgets['rss'] * RSS_LOW_WATER:
+                    self.rss_evicted = False
+            elif rss > self.budgets['rss']:
+                evicted: int = self._evict_cache(0)
+                evicted += self._evict_logs(sum(usage['bytes'] for usage in self.log_usage().values()) // 2)
+                gc.collect()
+                self.evictions['rss'] += 1
+                self.evicted_bytes['rss'] += evicted
+                self.rss_evicted = True
+                LOG.warning('Memory budget for the process exceeded (rss %d bytes), cleared cache and halved logs. No further eviction until rss '
+                            'falls below %d bytes', rss, int(self.budgets['rss'] * RSS_LOW_WATER))
+
+    def tracemalloc_start(self, frames: int = 1) -> None:
+        """
+        Start tracing memory allocations. Tracing slows down the process and uses additional memory, stop it when done.
+
+        Args:
+            frames (int): Number of frames stored per allocation.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self.tracemalloc_started = True
+        self.tracemalloc_snapshot = None
+
+    def tracemalloc_stop(self) -> None:
+        """
+        Stop tracing memory allocations and drop the stored snapshot.
+
+        Raises:
+            RuntimeError: If tracing was not started by the monitor.
+        """
+        if not self.tracemalloc_started:
+            raise RuntimeError('tracemalloc was not started by the web UI, it is left running')
+        tracemalloc.stop()
+        self.tracemalloc_started = False
+        self.tracemalloc_snapshot = None
+
+    def tracemalloc_top(self, top: int = 20, diff: bool = False) -> List[Dict[str, Any]]:
+        """
+        Take a tracemalloc snapshot and return the locations with the most allocated memory.
+
+        Args:
+            top (int): Number of locations to return.
+            diff (bool): Return the locations that grew most since the previous snapshot instead.
+
+        Returns:
+            List[Dict[str, Any]]: Location, size and number of allocations (and their change for diffs) of the top locations.
+
+        Raises:
+            RuntimeError: If tracemalloc is not tracing.
+        """
+        if not tracemalloc.is_tracing():
+            raise RuntimeError('tracemalloc is not tracing, start it first')
+        snapshot: tracemalloc.Snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        previous: Optional[tracemalloc.Snapshot] = self.tracemalloc_snapshot
+        self.tracemalloc_snapshot = snapshot
+        if diff:
+            if previous is None:
+                raise RuntimeError('No previous snapshot to compare with, take a snapshot first')
+            return [{'location': str(stat.traceback), 'size': stat.size, 'size_diff': stat.size_diff, 'count': stat.count,
+                     'count_diff': stat.count_diff} for stat in snapshot.compare_to(previous, 'lineno')[:top]]
+        return [{'location': str(stat.traceback), 'size': stat.size, 'count': stat.count} for stat in snapshot.statistics('lineno')[:top]]
+
+    # pylint: disable=duplicate-code
+    def start(self) -> None:
+        """
+        Start checking the budgets in the background if any budget is set.
+        """
+        if all(budget is None for budget in self.budgets.values()):
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._loop, name='carconnectivity.plugins.webui-memory')
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop checking the budgets and stop tracing allocations if the monitor started it.
+        """
+        self.stop_event.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join()
+        self.thread = None
+        if self.tracemalloc_started:
+            self.tracemalloc_stop()
+    # pylint: enable=duplicate-code
+
+    def _loop(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            self.enforce_budgets()
@@ -2,15 +2,23 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 
+import json
 import os
 
 import flask
+import flask_login
 
+from carconnectivity.json_util import ExtendedWithNullEncoder
 from carconnectivity_plugins.base.plugin import BasePlugin
 from carconnectivity_plugins.base.ui.plugin_ui import BasePluginUI
 
 if TYPE_CHECKING:
-    from typing import Optional, List, Dict, Union, Literal
+    from typing import Any, Optional, List, Dict, Union, Literal
+
+    from carconnectivity_plugins.webui.ui.webhooks import WebhookDispatcher
+
+# Actions on webhooks, posted with the name of the webhook as form field. Retry and clear apply to all webhooks without a name.
+WEBHOOK_ACTIONS: List[str] = ['test', 'pause', 'resume', 'retry', 'clear']
 
 
 class PluginUI(BasePluginUI):
@@ -22,11 +30,59 @@ class PluginUI(BasePluginUI):
                                                                template_folder=os.path.dirname(__file__) + '/templates')
         super().__init__(plugin, blueprint=blueprint, app=app, *args, **kwargs)
 
-    def get_nav_items(self) -> List[Dict[Literal['text', 'url', 'sublinks', 'divider'], Union[str, List]]]:  # pylint: disable=useless-parent-delegation
+        @self.blueprint.route('/webhooks', methods=['GET'])
+        @flask_login.login_required
+        def webhooks():
+            dispatcher: Optional[WebhookDispatcher] = getattr(self.plugin, 'webhooks', None)
+            return flask.render_template('plugins/webhooks.html', current_app=flask.current_app, plugin=self.plugin,
+                                         status=dispatcher.status() if dispatcher is not None else None,
+                                         dead_letters=dispatcher.get_dead_letters() if dispatcher is not None else [])
+
+        @self.blueprint.route('/webhooks/json', methods=['GET'])
+        @flask_login.login_required
+        def webhooks_json() -> flask.Response:
+            dispatcher: WebhookDispatcher = self._get_webhooks()
+            status: Dict[str, Any] = dispatcher.status()
+            status['dead_letters']['batches'] = dispatcher.get_dead_letters()
+            # Changes in dead letters contain values like enums that the default json provider cannot encode
+            response: flask.Response = flask.Response(json.dumps(status, cls=ExtendedWithNullEncoder), mimetype='application/json')
+            response.cache_control.no_store = True
+            return response
+
+        @self.blueprint.route('/webhooks/<string:action>', methods=['POST'])
+        @flask_login.login_required
+        def webhooks_action(action: str):
+            dispatcher: WebhookDispatcher = self._get_webhooks()
+            if action not in WEBHOOK_ACTIONS:
+                flask.abort(400, f'Unknown action {action}, must be one of {WEBHOOK_ACTIONS}')
+            name: Optional[str] = flask.request.form.get('name', default=None, type=str) or None
+            if name is not None and name not in dispatcher.webhooks:
+                flask.abort(404, f'Webhook {name} does not exist')
+            if action == 'retry':
+                flask.flash(f'Sending {dispatcher.retry_dead_letters(name)} dead-lettered batches again', 'info')
+            elif action == 'clear':
+                flask.flash(f'Discarded {dispatcher.clear_dead_letters(name)} dead-lettered batches', 'info')
+            elif name is None:
+                flask.abort(400, f'Action {action} requires the name of a webhook')
+            elif action == 'test':
+                success, message = dispatcher.send_test(name)
+                flask.flash(f'Test delivery to webhook {name}: {message}', 'success' if success else 'danger')
+            else:
+                dispatcher.webhooks[name].paused = action == 'pause'
+                flask.flash(f'Webhook {name} {"paused" if action == "pause" else "resumed"}', 'info')
+            return flask.redirect(flask.url_for('plugins.' + self.blueprint.name + '.webhooks'))
+
+    def _get_webhooks(self) -> WebhookDispatcher:
+        dispatcher: Optional[WebhookDispatcher] = getattr(self.plugin, 'webhooks', None)
+        if dispatcher is None:
+            flask.abort(404, "Webhooks are not configured")
+        return dispatcher
+
+    def get_nav_items(self) -> List[Dict[Literal['text', 'url', 'sublinks', 'divider'], Union[str, List]]]:
         """
         Generates a list of navigation items for the WebUI plugin UI.
         """
-        return super().get_nav_items()
+        return super().get_nav_items() + [{"text": "Webhooks", "url": flask.url_for('plugins.' + self.blueprint.name + '.webhooks')}]
 
     def get_title(self) -> str:
         """
@@ -0,0 +1,308 @@
+""" In-process reload of configuration, connectors, plugins and the web server of the web UI"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from json_minify import json_minify
+
+from carconnectivity.errors import ConfigurationError
+
+if TYPE_CHECKING:
+    from typing import Any, Dict, List, Optional
+
+    from carconnectivity.carconnectivity import CarConnectivity
+    from carconnectivity_connectors.base.connector import BaseConnector
+    from carconnectivity_plugins.base.plugin import BasePlugin
+
+    from carconnectivity_plugins.webui.ui.webui import WebUI
+
+LOG: logging.Logger = logging.getLogger("carconnectivity.plugins.webui")
+
+# Time in seconds the restart page gets to load before the web server goes down
+RESTART_GRACE_PERIOD: float = 1.0
+
+
+class Reloader:  # pylint: disable=too-many-instance-attributes
+    """
+    Reloads parts of CarConnectivity in-process instead of restarting the whole python process.
+
+    Valid targets are:
+        'all': Re-read the configuration, restart all connectors and plugins and the web server.
+        'webserver': Restart only the web server of the web UI.
+        'connector:<id>': Re-read the configuration and restart a single connector.
+        'plugin:<id>': Re-read the configuration and restart a single plugin. The web UI plugin itself only restarts its web server,
+            changes of its own configuration fail the reload as they are only applied after a restart of the process.
+        'process': Restart the whole python process (previous behaviour, needed e.g. after updates of installed packages).
+
+    The reload runs in its own thread. Progress can be queried with `status()`.
+
+    Args:
+        webui (WebUI): The web UI that owns the web server.
+        config_file (Optional[str]): Configuration file to re-read. If None the configuration CarConnectivity was started with is reused.
+        drain_timeout (float): Time in seconds to wait for in-flight requests before the web server is stopped.
+    """
+    def __init__(self, webui: WebUI, config_file: Optional[str] = None, drain_timeout: float = 10.0) -> None:
+        self.webui: WebUI = webui
+        self.config_file: Optional[str] = config_file
+        self.drain_timeout: float = drain_timeout
+        # The web UI is never recreated in-process, so it keeps running with the configuration it was started with
+        self.startup_config: Dict[str, Any] = webui.car_connectivity.config
+        self.lock: threading.Lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.state: str = 'idle'
+        self.target: Optional[str] = None
+        self.started: Optional[datetime] = None
+        self.finished: Optional[datetime] = None
+        self.steps: List[Dict[str, Any]] = []
+        self.downtime: Dict[str, float] = {}
+
+    @property
+    def car_connectivity(self) -> CarConnectivity:
+        """ The CarConnectivity instance that is reloaded """
+        return self.webui.car_connectivity
+
+    def is_running(self) -> bool:
+        """
+        Returns True if a reload is in progress.
+        """
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, target: str = 'all') -> bool:
+        """
+        Start a reload in the background.
+
+        Args:
+            target (str): What to reload, see class documentation for valid targets.
+
+        Returns:
+            bool: False if another reload is still in progress, True otherwise.
+
+        Raises:
+            ValueError: If the target is invalid.
+        """
+        if target not in ('all', 'webserver', 'process') and not target.startswith(('connector:', 'plugin:')):
+            raise ValueError(f'Invalid reload target {target}')
+        with self.lock:
+            if self.is_running():
+                return False
+            self.state = 'running'
+            self.target = target
+            self.started = datetime.now(tz=timezone.utc)
+            self.finished = None
+            self.steps = []
+            self.downtime = {}
+            self.thread = threading.Thread(target=self._run, args=(target,), name='carconnectivity.plugins.webui-reload')
+            self.thread.start()
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Returns the progress of the current or last reload.
+
+        Returns:
+            Dict[str, Any]: Dictionary with state, target, start and end time, the steps performed so far and the measured downtime
+            in seconds per component.
+        """
+        with self.lock:
+            return {
+                'state': self.state,
+                'target': self.target,
+                'started': self.started.isoformat() if self.started is not None else None,
+                'finished': self.finished.isoformat() if self.finished is not None else None,
+                'steps': list(self.steps),
+                'downtime': dict(self.downtime),
+            }
+
+    def _step(self, message: str) -> None:
+        LOG.info('Reload: %s', message)
+        with self.lock:
+            self.steps.append({'time': datetime.now(tz=timezone.utc).isoformat(), 'message': message})
+
+    def _run(self, target: str) -> None:
+        try:
+            if target == 'process':
+                self._restart_process()
+            elif target == 'webserver':
+                self._restart_webserver()
+            else:
+                config: Dict[str, Any] = self._read_config()
+                if target == 'all':
+                    self._reload_all(config)
+                elif target.startswith('connector:'):
+                    self._restart_connector(target[len('connector:'):], config)
+                else:
+                    self._restart_plugin(target[len('plugin:'):], config)
+            state: str = 'finished'
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            LOG.error('Reload of %s failed: %s', target, err)
+            self._step(f'Failed: {err}')
+            state = 'failed'
+        with self.lock:
+            self.state = state
+            self.finished = datetime.now(tz=timezone.utc)
+
+    def _read_config(self) -> Dict[str, Any]:
+        if self.config_file is None:
+            self._step('No config_file configured, reusing the configuration CarConnectivity was started with')
+            return self.car_connectivity.config
+        self._step(f'Reading configuration from {self.config_file}')
+        try:
+            with open(self.config_file, 'r', encoding='utf-8') as file:
+                config: Dict[str, Any] = json.loads(json_minify(file.read(), strip_space=False))
+        except json.JSONDecodeError as err:
+            raise ConfigurationError(f'Could not parse configuration file {self.config_file}: {err}') from err
+        except OSError as err:
+            raise ConfigurationError(f'Could not read configuration file {self.config_file}: {err}') from err
+        if 'carConnectivity' not in config:
+            raise ConfigurationError(f'Configuration file {self.config_file} has no carConnectivity section')
+        self.car_connectivity.config = config
+        return config
+
+    @staticmethod
+    def _find_config(config: Dict[str, Any], section: str, object_id: str) -> Optional[Dict[str, Any]]:
+        id_key: str = 'connector_id' if section == 'connectors' else 'plugin_id'
+        for object_config in config['carConnectivity'].get(section, []):
+            if 'type' not in object_config:
+                raise ConfigurationError(f"Invalid configuration: 'type' is missing in {section[:-1]}")
+            if object_config.get(id_key) is not None:
+                config_id: str = object_config[id_key]
+            else:
+                config_id = object_config['type']
+            if config_id == object_id:
+                if object_config.get('disabled', False):
+                    return None
+                return object_config
+        return None
+
+    def _configured_ids(self, config: Dict[str, Any], section: str) -> List[str]:
+        id_key: str = 'connector_id' if section == 'connectors' else 'plugin_id'
+        object_ids: List[str] = []
+        for object_config in config['carConnectivity'].get(section, []):
+            if 'type' in object_config and not object_config.get('disabled', False):
+                object_ids.append(object_config[id_key] if object_config.get(id_key) is not None else object_config['type'])
+        return object_ids
+
+    def _reload_all(self, config: Dict[str, Any]) -> None:
+        for connector_id in list(self.car_connectivity.connectors.connectors.keys()):
+            if connector_id not in self._configured_ids(config, 'connectors'):
+                self._remove_connector(connector_id)
+        for connector_id in self._configured_ids(config, 'connectors'):
+            self._restart_connector(connector_id, config)
+        for plugin_id in list(self.car_connectivity.plugins.plugins.keys()):
+            if plugin_id not in self._configured_ids(config, 'plugins') and not self._is_own_plugin(plugin_id):
+                self._remove_plugin(plugin_id)
+        own_plugin_ids: List[str] = [plugin_id for plugin_id in self._configured_ids(config, 'plugins') if self._is_own_plugin(plugin_id)]
+        for plugin_id in self._configured_ids(config, 'plugins'):
+            if plugin_id not in own_plugin_ids:
+                self._restart_plugin(plugin_id, config)
+        self.car_connectivity.persist()
+        # The web UI goes last, so all other connectors and plugins are restarted even if its own configuration cannot be applied
+        for plugin_id in own_plugin_ids:
+            self._restart_plugin(plugin_id, config)
+
+    def _remove_connector(self, connector_id: str) -> None:
+        self._step(f'Removing connector {connector_id} as it is no longer configured')
+        connector: BaseConnector = self.car_connectivity.connectors.connectors.pop(connector_id)
+        connector.shutdown()
+        connector.parent = None
+
+    def _remove_plugin(self, plugin_id: str) -> None:
+        self._step(f'Removing plugin {plugin_id} as it is no longer configured')
+        plugin: BasePlugin = self.car_connectivity.plugins.plugins.pop(plugin_id)
+        plugin.shutdown()
+        plugin.parent = None
+
+    def _restart_connector(self, connector_id: str, config: Dict[str, Any]) -> None:
+        # imported here as carconnectivity.carconnectivity imports this plugin while discovering plugins
+        from carconnectivity.carconnectivity import discovered_connectors  # pylint: disable=import-outside-toplevel
+
+        connector_config: Optional[Dict[str, Any]] = self._find_config(config, 'connectors', connector_id)
+        if connector_config is None:
+            if connector_id in self.car_connectivity.connectors.connectors:
+                self._remove_connector(connector_id)
+                return
+            raise ConfigurationError(f'Connector {connector_id} is not configured')
+        if f"carconnectivity_connectors.{connector_config['type']}" not in discovered_connectors:
+            raise ConfigurationError(f"Invalid configuration: connector type '{connector_config['type']}' is not known")
+        start: float = time.monotonic()
+        old_connector: Optional[BaseConnector] = self.car_connectivity.connectors.connectors.pop(connector_id, None)
+        if old_connector is not None:
+            self._step(f'Shutting down connector {connector_id}')
+            old_connector.shutdown()
+            old_connector.parent = None
+        self._step(f'Starting connector {connector_id}')
+        connector_class = getattr(discovered_connectors[f"carconnectivity_connectors.{connector_config['type']}"], 'Connector')
+        connector: BaseConnector = connector_class(connector_id=connector_id, car_connectivity=self.car_connectivity, config=connector_config['config'],
+                                                   initialization=self.car_connectivity.connectors.get_initialization(connector_id))
+        self.car_connectivity.connectors.connectors[connector_id] = connector
+        connector.startup()
+        if connector_id in self.webui.connector_uis:
+            self.webui.connector_uis[connector_id].connector = connector
+        elif old_connector is None:
+            self._step(f'UI of new connector {connector_id} will be available after a restart of the process')
+        self.downtime[f'connector:{connector_id}'] = time.monotonic() - start
+
+    def _is_own_plugin(self, plugin_id: str) -> bool:
+        plugin: Optional[BasePlugin] = self.car_connectivity.plugins.plugins.get(plugin_id)
+        return plugin is not None and getattr(plugin, 'webui', None) is self.webui
+
+    def _restart_plugin(self, plugin_id: str, config: Dict[str, Any]) -> None:
+        # imported here as carconnectivity.carconnectivity imports this plugin while discovering plugins
+        from carconnectivity.carconnectivity import discovered_plugins  # pylint: disable=import-outside-toplevel
+
+        if self._is_own_plugin(plugin_id):
+            # The web UI cannot replace its own flask app and the components created with it, only the web server serving it is restarted
+            if self._find_config(config, 'plugins', plugin_id) != self._find_config(self.startup_config, 'plugins', plugin_id):
+                raise ConfigurationError(f'Configuration of plugin {plugin_id} changed, it is only applied after a restart of the process')
+            self._restart_webserver()
+            return
+        plugin_config: Optional[Dict[str, Any]] = self._find_config(config, 'plugins', plugin_id)
+        if plugin_config is None:
+            if plugin_id in self.car_connectivity.plugins.plugins:
+                self._remove_plugin(plugin_id)
+                return
+            raise ConfigurationError(f'Plugin {plugin_id} is not configured')
+        if f"carconnectivity_plugins.{plugin_config['type']}" not in discovered_plugins:
+            raise ConfigurationError(f"Invalid configuration: plugin type '{plugin_config['type']}' is not known")
+        start: float = time.monotonic()
+        old_plugin: Optional[BasePlugin] = self.car_connectivity.plugins.plugins.pop(plugin_id, None)
+        if old_plugin is not None:
+            self._step(f'Shutting down plugin {plugin_id}')
+            old_plugin.shutdown()
+            old_plugin.parent = None
+        self._step(f'Starting plugin {plugin_id}')
+        plugin_class = getattr(discovered_plugins[f"carconnectivity_plugins.{plugin_config['type']}"], 'Plugin')
+        plugin: BasePlugin = plugin_class(plugin_id=plugin_id, car_connectivity=self.car_connectivity, config=plugin_config['config'],
+                                          initialization=self.car_connectivity.plugins.get_initialization(plugin_id))
+        self.car_connectivity.plugins.plugins[plugin_id] = plugin
+        plugin.startup()
+        if plugin_id in self.webui.plugin_uis:
+            self.webui.plugin_uis[plugin_id].plugin = plugin
+        elif old_plugin is None:
+            self._step(f'UI of new plugin {plugin_id} will be available after a restart of the process')
+        self.downtime[f'plugin:{plugin_id}'] = time.monotonic() - start
+
+    def _restart_webserver(self) -> None:
+        time.sleep(RESTART_GRACE_PERIOD)  # Give the restart page the chance to load before the web server goes down
+        self._step(f'Stopping web server, waiting up to {self.drain_timeout}s for in-flight requests')
+        start: float = time.monotonic()
+        if not self.webui.stop_server(drain_timeout=self.drain_timeout):
+            self._step(f'{self.webui.inflight_requests} requests still in flight after {self.drain_timeout}s, continuing anyway')
+        self.webui.start_server()
+        self.downtime['webserver'] = time.monotonic() - start
+        self._step(f"Web server restarted after {self.downtime['webserver']:.3f}s")
+
+    def _restart_process(self) -> None:
+        self._step('Shutting down CarConnectivity')
+        time.sleep(RESTART_GRACE_PERIOD)  # Give the restart page the chance to load before the web server goes down
+        self.car_connectivity.shutdown()
+        self._step('Restarting process')
+        python = sys.executable
+        os.execl(python, python, * sys.argv)  # nosec
@@ -0,0 +1,265 @@
+""" Persisted snapshots of rendered responses that are served while CarConnectivity has no live data yet after a restart"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import io
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from datetime import datetime, timezone
+
+import flask
+
+from carconnectivity_plugins.webui.ui.formats import negotiate_format
+
+# pylint: disable=duplicate-code
+SUPPORT_IMAGES = False  # pylint: disable=invalid-name
+try:
+    from PIL import Image  # pylint: disable=unused-import # noqa: F401
+    SUPPORT_IMAGES = True  # pylint: disable=invalid-name
+except ImportError:
+    pass
+# pylint: enable=duplicate-code
+
+if TYPE_CHECKING:
+    from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+    from carconnectivity.attributes import GenericAttribute
+    from carconnectivity.carconnectivity import CarConnectivity
+
+LOG: logging.Logger = logging.getLogger("carconnectivity.plugins.webui")
+
+# File layout: magic, format version, length of the index, index (json), blobs. The index maps keys to offset, length and mimetype
+# of the blobs relative to the start of the blob section, so entries can be sliced from the memory mapped file without parsing it.
+SNAPSHOT_MAGIC: bytes = b'CCWS'
+SNAPSHOT_FORMAT_VERSION: int = 1
+SNAPSHOT_HEADER: struct.Struct = struct.Struct('!4sHI')
+
+
+class SnapshotStore:  # pylint: disable=too-many-instance-attributes
+    """
+    Persists the last good garage snapshot (rendered json of CarConnectivity, the garage and each vehicle and the encoded vehicle images)
+    to a file in regular intervals. On startup the file is memory mapped and its entries are served, marked as stale, until all connectors
+    fetched their data for the first time.
+
+    Args:
+        car_connectivity (CarConnectivity): The CarConnectivity instance to take snapshots from.
+        path (str): Path of the snapshot file.
+        interval (float): Interval in seconds in which snapshots are written.
+    """
+    def __init__(self, car_connectivity: CarConnectivity, path: str, interval: float = 60.0) -> None:
+        self.car_connectivity: CarConnectivity = car_connectivity
+        self.path: str = path
+        self.interval: float = interval
+        self.lock: threading.Lock = threading.Lock()
+        self.stop_event: threading.Event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.live: bool = False
+        self.created: Optional[datetime] = None
+        self.index: Dict[str, Tuple[int, int, str]] = {}
+        self._file: Optional[BinaryIO] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._blob_offset: int = 0
+        self._image_cache: Dict[str, Tuple[datetime, bytes]] = {}
+        self.load()
+
+    def load(self) -> None:
+        """
+        Memory map the snapshot file if it exists. Invalid files are ignored.
+        """
+        if not os.path.isfile(self.path):
+            LOG.info('No webui snapshot found at %s', self.path)
+            return
+        try:
+            # The file is kept open for the memory map until live data is available
+            file: BinaryIO = open(self.path, 'rb')  # pylint: disable=consider-using-with
+            try:
+                snapshot_mmap: mmap.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, index_length = SNAPSHOT_HEADER.unpack_from(snapshot_mmap, 0)
+                if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT_VERSION:
+                    raise ValueError('wrong format or format version')
+                index: Dict[str, Any] = json.loads(snapshot_mmap[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + index_length])
+            except Exception:
+                file.close()
+                raise
+        except (OSError, ValueError, struct.error) as err:
+            LOG.warning('Ignoring webui snapshot %s: %s', self.path, err)
+            return
+        with self.lock:
+            self._file = file
+            self._mmap = snapshot_mmap
+            self._blob_offset = SNAPSHOT_HEADER.size + index_length
+            self.created = datetime.fromisoformat(index['created'])
+            self.index = {key: (entry[0], entry[1], entry[2]) for key, entry in index['entries'].items()}
+        LOG.info('Loaded webui snapshot from %s with %d entries created %s', self.path, len(self.index), self.created.isoformat())
+
+    def close(self) -> None:
+        """
+        Release the memory mapped snapshot.
+        """
+        with self.lock:
+            self.index = {}
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def is_live(self) -> bool:
+        """
+        Returns True as soon as CarConnectivity has vehicles in its garage and all connectors fetched their data for the first time.
+        Until then the vehicles of connectors that are still logging in are missing from the garage. From then on the snapshot is no
+        longer served and released.
+        """
+        if not self.live and self.car_connectivity.garage is not None and len(self.car_connectivity.garage.list_vehicles()) > 0 \
+                and all(connector.last_update.value is not None for connector in self.car_connectivity.connectors.connectors.values()):
+            self.live = True
+            if self._mmap is not None:
+                LOG.info('Live data available, no longer serving webui snapshot')
+                self.close()
+        return self.live
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Get an entry of the loaded snapshot.
+
+        Args:
+            key (str): The key of the entry, e.g. 'garage/json'.
+
+        Returns:
+            Optional[Tuple[bytes, str]]: The data and its mimetype or None if the entry does not exist or live data is available.
+        """
+        if self.is_live():
+            return None
+        with self.lock:
+            if self._mmap is None or key not in self.index:
+                return None
+            offset, length, mimetype = self.index[key]
+            start: int = self._blob_offset + offset
+            return self._mmap[start:start + length], mimetype
+
+    def _encode_image(self, attribute: GenericAttribute) -> bytes:
+        # Images rarely change, only encode them again if the value of the attribute changed since it was encoded
+        path: str = attribute.get_absolute_path()
+        cached: Optional[Tuple[datetime, bytes]] = self._image_cache.get(path)
+        if cached is not None and attribute.last_changed_local is not None and cached[0] == attribute.last_changed_local:
+            return cached[1]
+        img_io = io.BytesIO()
+        attribute.value.save(img_io, 'PNG')
+        if attribute.last_changed_local is not None:
+            self._image_cache[path] = (attribute.last_changed_local, img_io.getvalue())
+        return img_io.getvalue()
+
+    def collect(self) -> List[Tuple[str, bytes, str]]:
+        """
+        Render all entries of a snapshot from the current state of CarConnectivity.
+
+        Returns:
+            List[Tuple[str, bytes, str]]: List of key, data and mimetype.
+        """
+        entries: List[Tuple[str, bytes, str]] = []
+        entries.append(('json', self.car_connectivity.as_json().encode('utf-8'), 'text/json'))
+        entries.append(('garage/json', self.car_connectivity.garage.as_json().encode('utf-8'), 'text/json'))
+        for vehicle in self.car_connectivity.garage.list_vehicles():
+            vin: Optional[str] = vehicle.vin.value
+            if vin is None:
+                continue
+            entries.append((f'garage/{vin}/json', vehicle.as_json().encode('utf-8'), 'text/json'))
+            if SUPPORT_IMAGES and 'car_picture' in vehicle.images.images and vehicle.images.images['car_picture'].enabled \
+                    and vehicle.images.images['car_picture'].value is not None:
+                entries.append((f'garage/{vin}-car.png', self._encode_image(vehicle.images.images['car_picture']), 'image/png'))
+        return entries
+
+    def persist(self) -> bool:
+        """
+        Write a snapshot if CarConnectivity has live data. The file is replaced atomically.
+
+        Returns:
+            bool: True if a snapshot was written.
+        """
+        if self.car_connectivity.garage is None or len(self.car_connectivity.garage.list_vehicles()) == 0:
+            return False
+        entries: List[Tuple[str, bytes, str]] = self.collect()
+        index_entries: Dict[str, List[Any]] = {}
+        offset: int = 0
+        for key, data, mimetype in entries:
+            index_entries[key] = [offset, len(data), mimetype]
+            offset += len(data)
+        index: bytes = json.dumps({'created': datetime.now(tz=timezone.utc).isoformat(), 'entries': index_entries},
+                                  separators=(',', ':')).encode('utf-8')
+        temp_path: str = self.path + '.tmp'
+        try:
+            # The snapshot contains all vehicle data (e.g. positions), it is only readable by the owner
+            temp_descriptor: int = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            # The mode is only applied when the file is created, a temporary file left over from an earlier run may have another one
+            os.fchmod(temp_descriptor, 0o600)
+            with os.fdopen(temp_descriptor, 'wb') as file:
+                file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, len(index)))
+                file.write(index)
+                for _, data, _ in entries:
+                    file.write(data)
+            os.replace(temp_path, self.path)
+        except OSError as err:
+            LOG.error('Could not write webui snapshot to %s: %s', self.path, err)
+            return False
+        LOG.debug('Wrote webui snapshot with %d entries to %s', len(entries), self.path)
+        return True
+
+    # pylint: disable=duplicate-code
+    def start(self) -> None:
+        """
+        Start writing snapshots in the background.
+        """
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._loop, name='carconnectivity.plugins.webui-snapshot')
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop writing snapshots, write a last snapshot and release the loaded snapshot.
+        """
+        self.stop_event.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join()
+        self.thread = None
+        self.persist()
+        self.close()
+    # pylint: enable=duplicate-code
+
+    def _loop(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            self.persist()
+
+
+def stale_response(key: str) -> Optional[flask.Response]:
+    """
+    Build a response from the loaded snapshot if no live data is available yet.
+
+    Only the default representation (json without pretty printing or locale conversion) is served from the snapshot.
+    The response is marked stale with a Warning header and the age of the snapshot in the Age header.
+
+    Args:
+        key (str): The key of the entry, e.g. 'garage/json'.
+
+    Returns:
+        Optional[flask.Response]: The response or None if the live data has to be used.
+    """
+    store: Optional[SnapshotStore] = flask.current_app.extensions.get('carconnectivity_snapshot')
+    if store is None or store.created is None:
+        return None
+    if any(argument in flask.request.args for argument in ('pretty', 'in_locale', 'with_locale')):
+        return None
+    if not key.endswith('.png') and negotiate_format() != 'json':
+        return None
+    entry: Optional[Tuple[bytes, str]] = store.get(key)
+    if entry is None:
+        return None
+    response = flask.Response(entry[0], mimetype=entry[1])
+    response.headers['Warning'] = f'110 - "Response is Stale, snapshot from {store.created.isoformat()}"'
+    response.headers['Age'] = str(max(0, int((datetime.now(tz=timezone.utc) - store.created).total_seconds())))
+    response.cache_control.no_store = True
+    return response
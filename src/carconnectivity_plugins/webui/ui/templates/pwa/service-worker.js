@@ -0,0 +1,88 @@
+// Service worker of the CarConnectivity web UI, caches are bound to the version of the plugin and replaced on upgrade
+const CACHE_PREFIX = 'carconnectivity-';
+const STATIC_CACHE = CACHE_PREFIX + 'static-{{ version }}';
+const PAGES_CACHE = CACHE_PREFIX + 'pages-{{ version }}';
+const PRECACHE_URLS = {{ precache_urls|tojson }};
+
+self.addEventListener('install', (event) => {
+  event.waitUntil(
+    caches.open(STATIC_CACHE)
+      .then((cache) => cache.addAll(PRECACHE_URLS))
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener('activate', (event) => {
+  event.waitUntil(
+    caches.keys()
+      .then((keys) => Promise.all(keys
+        .filter((key) => key.startsWith(CACHE_PREFIX) && key !== STATIC_CACHE && key !== PAGES_CACHE)
+        .map((key) => caches.delete(key))))
+      .then(() => self.clients.claim())
+  );
+});
+
+function isCacheable(response) {
+  // Do not cache errors and pages the user was redirected to (e.g. the login page)
+  return response.ok && response.type === 'basic' && !response.redirected;
+}
+
+function cacheFirst(request) {
+  return caches.open(STATIC_CACHE).then((cache) => cache.match(request).then((cached) => {
+    if (cached) {
+      return cached;
+    }
+    return fetch(request).then((response) => {
+      if (isCacheable(response)) {
+        cache.put(request, response.clone());
+      }
+      return response;
+    });
+  }));
+}
+
+function staleWhileRevalidate(event) {
+  return caches.open(PAGES_CACHE).then((cache) => cache.match(event.request).then((cached) => {
+    const update = fetch(event.request).then((response) => {
+      if (isCacheable(response)) {
+        cache.put(event.request, response.clone());
+      }
+      return response;
+    });
+    if (cached) {
+      // Serve from cache right away and refresh the cache in the background, errors are ignored while offline
+      event.waitUntil(update.catch(() => undefined));
+      return cached;
+    }
+    return update;
+  }));
+}
+
+self.addEventListener('fetch', (event) => {
+  const request = event.request;
+  if (request.method !== 'GET') {
+    return;
+  }
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin) {
+    return;
+  }
+  if (url.pathname === '{{ url_for("logout") }}') {
+    // Cached pages contain vehicle data of the user, drop them when logging out
+    event.waitUntil(caches.delete(PAGES_CACHE));
+    return;
+  }
+  if (url.pathname.startsWith('/plugins/') || url.pathname.startsWith('/connectors/') || url.pathname.startsWith('/debug/')
+      || url.pathname.endsWith('/status')) {
+    // Status, statistics and actions of plugins and connectors must always be current, they are never served from the cache
+    return;
+  }
+  if (url.pathname.startsWith('{{ url_for("static", filename="") }}')) {
+    event.respondWith(cacheFirst(request));
+    return;
+  }
+  // Vehicle images change with the vehicle, like the pages they are revalidated in the background
+  if (url.pathname.startsWith('{{ url_for("garage.garage") }}') || url.pathname.endsWith('/json') || url.pathname.endsWith('-car.png')) {
+    event.respondWith(staleWhileRevalidate(event));
+  }
+});
@@ -0,0 +1,209 @@
+""" TLS support for the web UI: persistent self-signed certificates, a tuned SSL context and handshake statistics"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import logging
+import os
+import ssl
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from werkzeug.serving import generate_adhoc_ssl_pair
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+    from werkzeug.serving import BaseWSGIServer
+
+LOG: logging.Logger = logging.getLogger("carconnectivity.plugins.webui")
+
+# Certificates are generated again when they expire within this time
+CERTIFICATE_RENEW_BEFORE: timedelta = timedelta(days=30)
+
+# Forward secret AEAD ciphers for TLS 1.2, TLS 1.3 ciphers are not configurable and always modern
+TLS12_CIPHERS: str = 'ECDHE+AESGCM:ECDHE+CHACHA20'
+
+
+def ensure_self_signed_certificate(base_path: str, common_name: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Returns a self-signed certificate and key stored at `base_path`.crt and `base_path`.key. They are only generated if they do not
+    exist yet, cannot be read or expire soon, so clients can keep trusting the certificate and resuming sessions across restarts.
+
+    Args:
+        base_path (str): Path of the certificate and key without extension.
+        common_name (Optional[str]): Common name of a generated certificate, defaults to "*".
+
+    Returns:
+        Tuple[str, str]: Paths of the certificate and the key file.
+
+    Raises:
+        ImportError: If the cryptography library is not installed.
+    """
+    try:
+        from cryptography import x509  # pylint: disable=import-outside-toplevel
+        from cryptography.hazmat.primitives import serialization  # pylint: disable=import-outside-toplevel
+    except ImportError as err:
+        raise ImportError('Generating a self-signed certificate requires the cryptography library, install it with '
+                          '"pip3 install carconnectivity-plugin-webui[https]" or configure "ssl_certificate_file" and '
+                          '"ssl_certificate_key_file"') from err
+
+    cert_file: str = f'{base_path}.crt'
+    key_file: str = f'{base_path}.key'
+    if os.path.isfile(cert_file) and os.path.isfile(key_file):
+        try:
+            with open(cert_file, 'rb') as file:
+                certificate: x509.Certificate = x509.load_pem_x509_certificate(file.read())
+            if certificate.not_valid_after_utc - CERTIFICATE_RENEW_BEFORE > datetime.now(tz=timezone.utc):
+                return cert_file, key_file
+            LOG.info('Self-signed certificate %s expires on %s, generating a new one', cert_file, certificate.not_valid_after_utc.isoformat())
+        except (OSError, ValueError) as err:
+            LOG.warning('Cannot read self-signed certificate %s, generating a new one: %s', cert_file, err)
+
+    start: float = time.monotonic()
+    certificate, private_key = generate_adhoc_ssl_pair(cn=common_name)
+    directory: str = os.path.dirname(os.path.abspath(base_path))
+    os.makedirs(directory, exist_ok=True)
+    # The key is only readable by the owner
+    key_descriptor: int = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # The mode is only applied when the file is created, an existing key file that is overwritten keeps its mode otherwise
+    os.fchmod(key_descriptor, 0o600)
+    with os.fdopen(key_descriptor, 'wb') as file:
+        file.write(private_key.private_bytes(encoding=serialization.Encoding.PEM, format=serialization.PrivateFormat.TraditionalOpenSSL,
+                                             encryption_algorithm=serialization.NoEncryption()))
+    with open(cert_file, 'wb') as file:
+        file.write(certificate.public_bytes(serialization.Encoding.PEM))
+    LOG.info('Generated self-signed certificate %s in %.2fs', cert_file, time.monotonic() - start)
+    return cert_file, key_file
+
+
+class HandshakeStatistics:
+    """
+    Counts TLS handshakes of the web server and measures their duration, separately for full and resumed handshakes.
+
+    Args:
+        window (int): Number of recent handshakes used for the average durations.
+    """
+    def __init__(self, window: int = 1000) -> None:
+        self.lock: threading.Lock = threading.Lock()
+        self.full: int = 0
+        self.resumed: int = 0
+        self.failed: int = 0
+        self.full_durations: Deque[float] = deque(maxlen=window)
+        self.resumed_durations: Deque[float] = deque(maxlen=window)
+
+    def record(self, duration: float, resumed: bool) -> None:
+        """
+        Record a successful handshake.
+
+        Args:
+            duration (float): Duration of the handshake in seconds.
+            resumed (bool): True if a previous session was resumed.
+        """
+        with self.lock:
+            if resumed:
+                self.resumed += 1
+                self.resumed_durations.append(duration)
+            else:
+                self.full += 1
+                self.full_durations.append(duration)
+
+    def record_failure(self) -> None:
+        """
+        Record a failed handshake.
+        """
+        with self.lock:
+            self.failed += 1
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Returns handshake counters and average and maximum durations in milliseconds of the recent full and resumed handshakes.
+
+        Returns:
+            Dict[str, Any]: The handshake statistics.
+        """
+        def durations(values: Deque[float]) -> Dict[str, Optional[float]]:
+            if not values:
+                return {'avg_ms': None, 'max_ms': None}
+            return {'avg_ms': round(sum(values) / len(values) * 1000, 3), 'max_ms': round(max(values) * 1000, 3)}
+        with self.lock:
+            total: int = self.full + self.resumed
+            return {
+                'handshakes': total,
+                'full': self.full,
+                'resumed': self.resumed,
+                'failed': self.failed,
+                'resumption_rate': round(self.resumed / total, 3) if total > 0 else None,
+                'full_durations': durations(self.full_durations),
+                'resumed_durations': durations(self.resumed_durations),
+            }
+
+
+class ServerSSLContext(ssl.SSLContext):
+    """
+    SSL context for the web server. Accepted connections are not handshaked in the accept loop of the server but in the thread that
+    handles the connection (see `track_handshakes`), so a slow client cannot block accepting other connections.
+    """
+    def wrap_socket(self, *args, **kwargs) -> ssl.SSLSocket:  # type: ignore[override]  # pylint: disable=arguments-differ
+        if kwargs.get('server_side', False):
+            kwargs['do_handshake_on_connect'] = False
+        return super().wrap_socket(*args, **kwargs)
+
+
+def create_ssl_context(cert_file: str, key_file: str, alpn_protocols: Optional[List[str]] = None, session_tickets: int = 2) -> ServerSSLContext:
+    """
+    Create a server SSL context with TLS 1.2 as minimum version, forward secret AEAD ciphers and session resumption.
+
+    Sessions are resumed with session tickets (TLS 1.2 and 1.3) and the session cache of the context. The context is kept across restarts
+    of the web server, so clients can resume their sessions after in-process restarts.
+
+    Args:
+        cert_file (str): Path of the certificate (chain) file.
+        key_file (str): Path of the key file.
+        alpn_protocols (Optional[List[str]]): Protocols offered with ALPN, defaults to http/1.1.
+        session_tickets (int): Number of TLS 1.3 session tickets sent after a full handshake, 0 disables session tickets.
+
+    Returns:
+        ServerSSLContext: The SSL context.
+    """
+    context: ServerSSLContext = ServerSSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(TLS12_CIPHERS)
+    context.options |= ssl.OP_NO_COMPRESSION | ssl.OP_CIPHER_SERVER_PREFERENCE
+    if session_tickets > 0:
+        context.options &= ~ssl.Options.OP_NO_TICKET
+        context.num_tickets = session_tickets
+    else:
+        context.options |= ssl.Options.OP_NO_TICKET
+        context.num_tickets = 0
+    context.set_alpn_protocols(alpn_protocols if alpn_protocols is not None else ['http/1.1'])
+    context.load_cert_chain(cert_file, key_file)
+    return context
+
+
+def track_handshakes(server: BaseWSGIServer, statistics: HandshakeStatistics, timeout: float = 10.0) -> None:
+    """
+    Perform the TLS handshake of each connection in the thread handling the connection and record it in `statistics`.
+
+    Args:
+        server (BaseWSGIServer): The server, its SSL context has to be a ServerSSLContext.
+        timeout (float): Timeout in seconds for the handshake.
+    """
+    finish_request: Callable[[Any, Any], None] = server.finish_request
+
+    def finish_request_with_handshake(request: Any, client_address: Any) -> None:
+        if isinstance(request, ssl.SSLSocket):
+            previous_timeout: Optional[float] = request.gettimeout()
+            request.settimeout(timeout)
+            start: float = time.perf_counter()
+            try:
+                request.do_handshake()
+            except (ssl.SSLError, OSError) as err:
+                statistics.record_failure()
+                LOG.debug('TLS handshake with %s failed: %s', client_address, err)
+                return
+            statistics.record(time.perf_counter() - start, request.session_reused)
+            request.settimeout(previous_timeout)
+        finish_request(request, client_address)
+    server.finish_request = finish_request_with_handshake  # type: ignore[method-assign]
@@ -0,0 +1,194 @@
+""" In-memory search index over the vehicles in the garage"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import bisect
+import re
+import threading
+
+from carconnectivity.observable import Observable
+
+if TYPE_CHECKING:
+    from typing import Any, Dict, List, Optional, Set, Tuple
+
+    from carconnectivity.garage import Garage
+    from carconnectivity.vehicle import GenericVehicle
+
+# Fields of a vehicle that are indexed and can be used for sorting: field name -> attribute of the vehicle.
+# Changes of all fields except the VIN are observed, vehicles with a different VIN are picked up as new vehicles.
+INDEX_FIELDS: Dict[str, str] = {
+    'vin': 'vin',
+    'name': 'name',
+    'license_plate': 'license_plate',
+    'model': 'model',
+}
+OBSERVED_FIELDS: List[str] = ['name', 'license_plate', 'model']
+
+OBSERVED_EVENTS: Observable.ObserverEvent = Observable.ObserverEvent.VALUE_CHANGED | Observable.ObserverEvent.ENABLED \
+    | Observable.ObserverEvent.DISABLED
+
+TOKEN_SPLIT: re.Pattern = re.compile(r'[^0-9a-z]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lowercase alphanumeric tokens. For texts with separators, e.g. license plates like "B-CC 123",
+    the text without separators is added as additional token, so "bcc123" matches as well as "cc 123".
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        List[str]: The tokens.
+    """
+    tokens: List[str] = [token for token in TOKEN_SPLIT.split(text.lower()) if token]
+    if len(tokens) > 1:
+        tokens.append(''.join(tokens))
+    return tokens
+
+
+class VehicleIndex:
+    """
+    Search index over VIN, name, license plate and model of the vehicles in the garage.
+
+    Vehicles that were added to or removed from the garage are picked up incrementally on the next access. Changes of the indexed
+    attributes of a vehicle are tracked with observers, so only the changed vehicle is indexed again. Searching matches every token of
+    the query as prefix of a token of the indexed fields, the sorted token list is searched with bisection.
+
+    Args:
+        garage (Garage): The garage to index.
+    """
+    def __init__(self, garage: Garage) -> None:
+        self.garage: Garage = garage
+        self.lock: threading.RLock = threading.RLock()
+        self.documents: Dict[str, Dict[str, Optional[str]]] = {}
+        self._vehicles: Dict[str, GenericVehicle] = {}
+        self._tokens: Dict[str, Set[str]] = {}
+        self._sorted_tokens: Optional[List[str]] = None
+        self._sort_orders: Dict[str, List[str]] = {}
+
+    def refresh(self) -> None:
+        """
+        Index vehicles that were added to the garage and drop vehicles that were removed or replaced since the last call.
+        """
+        current: Dict[str, GenericVehicle] = {vehicle.vin.value: vehicle for vehicle in self.garage.list_vehicles() if vehicle.vin.value is not None}
+        with self.lock:
+            for vin in [vin for vin, vehicle in self._vehicles.items() if current.get(vin) is not vehicle]:
+                self._remove(vin)
+            for vin, vehicle in current.items():
+                if vin not in self._vehicles:
+                    self._add(vin, vehicle)
+
+    def _add(self, vin: str, vehicle: GenericVehicle) -> None:
+        self._vehicles[vin] = vehicle
+        for attribute in OBSERVED_FIELDS:
+            getattr(vehicle, attribute).add_observer(self._on_attribute_change, flag=OBSERVED_EVENTS)
+        self._index(vin)
+
+    def _remove(self, vin: str) -> None:
+        # The observers stay attached as Observable.remove_observer removes all other observers instead. Notifications of vehicles
+        # that are no longer indexed are ignored, adding the observers again when the vehicle returns does not duplicate them.
+        del self._vehicles[vin]
+        self._unindex(vin)
+        del self.documents[vin]
+
+    def _index(self, vin: str) -> None:
+        vehicle: GenericVehicle = self._vehicles[vin]
+        document: Dict[str, Optional[str]] = {}
+        for field, attribute in INDEX_FIELDS.items():
+            element = getattr(vehicle, attribute)
+            document[field] = str(element.value) if element.enabled and element.value is not None else None
+        self.documents[vin] = document
+        for value in document.values():
+            if value is not None:
+                for token in tokenize(value):
+                    self._tokens.setdefault(token, set()).add(vin)
+        self._sorted_tokens = None
+        self._sort_orders = {}
+
+    def _unindex(self, vin: str) -> None:
+        for value in self.documents[vin].values():
+            if value is not None:
+                for token in tokenize(value):
+                    vins: Optional[Set[str]] = self._tokens.get(token)
+                    if vins is not None:
+                        vins.discard(vin)
+                        if not vins:
+                            del self._tokens[token]
+        self._sorted_tokens = None
+        self._sort_orders = {}
+
+    def _on_attribute_change(self, element: Any, flags: Observable.ObserverEvent) -> None:
+        del flags
+        vehicle: GenericVehicle = element.parent
+        with self.lock:
+            if vehicle.vin.value is not None and self._vehicles.get(vehicle.vin.value) is vehicle:
+                self._unindex(vehicle.vin.value)
+                self._index(vehicle.vin.value)
+
+    def _match_prefix(self, prefix: str) -> Set[str]:
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self._tokens)
+        vins: Set[str] = set()
+        position: int = bisect.bisect_left(self._sorted_tokens, prefix)
+        while position < len(self._sorted_tokens) and self._sorted_tokens[position].startswith(prefix):
+            vins |= self._tokens[self._sorted_tokens[position]]
+            position += 1
+        return vins
+
+    def _sort_order(self, sort: str, descending: bool) -> List[str]:
+        sort_key: str = f'{sort}:{"desc" if descending else "asc"}'
+        if sort_key not in self._sort_orders:
+            # Vehicles without a value for the sort field are sorted last in both directions
+            with_value: List[str] = sorted((vin for vin, document in self.documents.items() if document[sort] is not None),
+                                           key=lambda vin: ((self.documents[vin][sort] or '').lower(), vin), reverse=descending)
+            without_value: List[str] = sorted(vin for vin, document in self.documents.items() if document[sort] is None)
+            self._sort_orders[sort_key] = with_value + without_value
+        return self._sort_orders[sort_key]
+
+    # pylint: disable-next=too-many-arguments, too-many-positional-arguments
+    def query(self, search: Optional[str] = None, sort: str = 'name', descending: bool = False, offset: int = 0,
+              limit: Optional[int] = None) -> Tuple[int, List[str]]:
+        """
+        Search, sort and paginate the vehicles of the garage.
+
+        Args:
+            search (Optional[str]): Search query, every token of the query has to match the beginning of a token of VIN, name,
+                license plate or model.
+            sort (str): Field to sort by, one of INDEX_FIELDS.
+            descending (bool): Sort in descending order.
+            offset (int): Number of matching vehicles to skip.
+            limit (Optional[int]): Maximum number of vehicles to return, None for all.
+
+        Returns:
+            Tuple[int, List[str]]: The number of matching vehicles and the VINs of the requested page.
+
+        Raises:
+            ValueError: If the sort field is unknown.
+        """
+        if sort not in INDEX_FIELDS:
+            raise ValueError(f'Unknown sort field {sort}, must be one of {list(INDEX_FIELDS)}')
+        self.refresh()
+        with self.lock:
+            order: List[str] = self._sort_order(sort, descending)
+            if search:
+                matches: Optional[Set[str]] = None
+                for token in tokenize(search):
+                    token_matches: Set[str] = self._match_prefix(token)
+                    matches = token_matches if matches is None else matches & token_matches
+                order = [vin for vin in order if matches is None or vin in matches]
+            end: Optional[int] = offset + limit if limit is not None else None
+            return len(order), order[offset:end]
+
+    def get_vehicle(self, vin: str) -> Optional[GenericVehicle]:
+        """
+        Returns the indexed vehicle with the given VIN.
+
+        Args:
+            vin (str): The VIN of the vehicle.
+
+        Returns:
+            Optional[GenericVehicle]: The vehicle or None if it is not indexed.
+        """
+        with self.lock:
+            return self._vehicles.get(vin)
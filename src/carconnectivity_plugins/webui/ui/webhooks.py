@@ -0,0 +1,504 @@
+""" Outbound webhooks that post batches of attribute changes of CarConnectivity"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import concurrent.futures
+import fnmatch
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from carconnectivity.attributes import GenericAttribute
+from carconnectivity.json_util import ExtendedWithNullEncoder
+from carconnectivity.observable import Observable
+
+if TYPE_CHECKING:
+    from typing import Any, Deque, Dict, List, Optional, Tuple
+
+    from carconnectivity.carconnectivity import CarConnectivity
+
+LOG: logging.Logger = logging.getLogger("carconnectivity.plugins.webui")
+
+OBSERVED_EVENTS: Observable.ObserverEvent = Observable.ObserverEvent.VALUE_CHANGED | Observable.ObserverEvent.ENABLED \
+    | Observable.ObserverEvent.DISABLED
+
+# Status codes that are worth sending a batch again for, other client errors will fail again
+RETRY_STATUS_CODES: Tuple[int, ...] = (408, 425, 429, 500, 502, 503, 504)
+
+SIGNATURE_HEADER: str = 'X-CarConnectivity-Signature'
+DELIVERY_HEADER: str = 'X-CarConnectivity-Delivery'
+
+
+def event_name(flags: Observable.ObserverEvent) -> str:
+    """
+    Returns the name of an observer event as used in the webhook payload.
+
+    Args:
+        flags (Observable.ObserverEvent): The flags of the notification.
+
+    Returns:
+        str: 'disabled', 'enabled' or 'value_changed'.
+    """
+    if flags & Observable.ObserverEvent.DISABLED:
+        return 'disabled'
+    if flags & Observable.ObserverEvent.ENABLED:
+        return 'enabled'
+    return 'value_changed'
+
+
+class Webhook:  # pylint: disable=too-many-instance-attributes
+    """
+    An HTTP endpoint that receives changes of the attributes matching its path filters as JSON batches with POST requests.
+
+    Each webhook keeps its own HTTP session so the connection is kept alive between batches. If a secret is configured, the body is
+    signed with HMAC-SHA256 and the signature is sent in the X-CarConnectivity-Signature header as "sha256=<hex digest>".
+
+    Args:
+        name (str): Name of the webhook.
+        url (str): URL the batches are posted to.
+        paths (Optional[List[str]]): Shell-style patterns matched against the absolute path of the changed attributes,
+            e.g. "/garage/*/charging/state". Defaults to all attributes.
+        headers (Optional[Dict[str, str]]): Additional headers, e.g. for authorization.
+        secret (Optional[str]): Secret to sign the body with.
+        timeout (float): Timeout in seconds for connecting and for reading the response.
+        verify (bool): Verify the TLS certificate of the endpoint.
+        batch_size (int): Maximum number of changes in one batch.
+        max_delay (float): Maximum time in seconds a change waits for more changes before it is sent.
+        max_retries (int): Number of retries of a failed batch before it is dead-lettered.
+        backoff (float): Delay in seconds before the first retry, doubled with every further retry.
+        max_backoff (float): Maximum delay in seconds between retries.
+    """
+    # pylint: disable-next=too-many-arguments, too-many-positional-arguments, too-many-locals
+    def __init__(self, name: str, url: str, paths: Optional[List[str]] = None, headers: Optional[Dict[str, str]] = None, secret: Optional[str] = None,
+                 timeout: float = 10.0, verify: bool = True, batch_size: int = 50, max_delay: float = 2.0, max_retries: int = 5,
+                 backoff: float = 1.0, max_backoff: float = 300.0) -> None:
+        self.name: str = name
+        self.url: str = url
+        self.paths: List[str] = paths if paths else ['*']
+        self.patterns: List[re.Pattern] = [re.compile(fnmatch.translate(path)) for path in self.paths]
+        self.secret: Optional[bytes] = secret.encode('utf-8') if secret is not None else None
+        self.timeout: float = timeout
+        self.batch_size: int = batch_size
+        self.max_delay: float = max_delay
+        self.max_retries: int = max_retries
+        self.backoff: float = backoff
+        self.max_backoff: float = max_backoff
+        self.paused: bool = False
+        self.session: requests.Session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.verify = verify
+        self.session.headers.update({'Content-Type': 'application/json'})
+        if headers is not None:
+            self.session.headers.update(headers)
+        self.lock: threading.Lock = threading.Lock()
+        self.counters: Dict[str, int] = {'queued': 0, 'dropped': 0, 'coalesced': 0, 'batches': 0, 'delivered': 0, 'attempts': 0, 'retries': 0,
+                                         'dead_lettered': 0}
+        self.last_success: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.last_status: Optional[int] = None
+        self.last_latency: Optional[float] = None
+
+    def matches(self, path: str) -> bool:
+        """
+        Check if changes of an attribute are sent to this webhook.
+
+        Args:
+            path (str): The absolute path of the attribute.
+
+        Returns:
+            bool: True if the path matches one of the path filters.
+        """
+        return any(pattern.match(path) for pattern in self.patterns)
+
+    def count(self, counter: str, value: int = 1) -> None:
+        """
+        Increase a delivery counter.
+
+        Args:
+            counter (str): The name of the counter.
+            value (int): The value to add.
+        """
+        with self.lock:
+            self.counters[counter] += value
+
+    def post(self, delivery_id: str, changes: List[Dict[str, Any]]) -> requests.Response:
+        """
+        Post a batch of changes once. The attempt and its outcome are recorded in the statistics.
+
+        Args:
+            delivery_id (str): ID of the batch, it stays the same when the batch is sent again so receivers can discard duplicates.
+            changes (List[Dict[str, Any]]): The changes.
+
+        Returns:
+            requests.Response: The response of the endpoint.
+
+        Raises:
+            requests.RequestException: If the endpoint could not be reached.
+        """
+        body: bytes = json.dumps({'webhook': self.name, 'delivery': delivery_id, 'sent': datetime.now(tz=timezone.utc).isoformat(),
+                                  'changes': changes}, cls=ExtendedWithNullEncoder, separators=(',', ':')).encode('utf-8')
+        headers: Dict[str, str] = {DELIVERY_HEADER: delivery_id}
+        if self.secret is not None:
+            headers[SIGNATURE_HEADER] = 'sha256=' + hmac.new(self.secret, body, hashlib.sha256).hexdigest()
+        self.count('attempts')
+        start: float = time.monotonic()
+        try:
+            response: requests.Response = self.session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+        except requests.RequestException as err:
+            with self.lock:
+                self.last_error = str(err)
+                self.last_status = None
+            raise
+        with self.lock:
+            self.last_latency = time.monotonic() - start
+            self.last_status = response.status_code
+            if response.ok:
+                self.last_success = datetime.now(tz=timezone.utc)
+                self.last_error = None
+                self.counters['batches'] += 1
+                self.counters['delivered'] += len(changes)
+            else:
+                self.last_error = f'HTTP {response.status_code} {response.reason}'
+        return response
+
+    def retry_delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """
+        Returns the delay before the next attempt: exponential backoff with jitter, or the Retry-After header of the response if it is
+        given in seconds.
+
+        Args:
+            attempt (int): Number of the failed attempt, starting with 0.
+            response (Optional[requests.Response]): The response of the failed attempt.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return min(float(response.headers['Retry-After']), self.max_backoff)
+        return min(self.backoff * 2 ** attempt, self.max_backoff) * random.uniform(0.5, 1.0)  # nosec
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Returns the configuration and delivery statistics of the webhook.
+
+        Returns:
+            Dict[str, Any]: Dictionary with url, path filters, paused state, counters, last success, last error, last status code and
+                latency of the last attempt in milliseconds.
+        """
+        with self.lock:
+            return {
+                'url': self.url,
+                'paths': self.paths,
+                'paused': self.paused,
+                'healthy': self.last_error is None,
+                'counters': dict(self.counters),
+                'last_success': self.last_success.isoformat() if self.last_success is not None else None,
+                'last_error': self.last_error,
+                'last_status': self.last_status,
+                'last_latency_ms': round(self.last_latency * 1000, 3) if self.last_latency is not None else None,
+            }
+
+    def close(self) -> None:
+        """
+        Close the connections to the endpoint.
+        """
+        self.session.close()
+
+
+class WebhookDispatcher:  # pylint: disable=too-many-instance-attributes
+    """
+    Sends changes of CarConnectivity attributes to webhooks.
+
+    One observer on CarConnectivity puts the changes of matching attributes into a bounded queue, changes that do not fit into the queue
+    are dropped and counted, so connectors are never blocked by slow endpoints. A worker collects the changes per webhook: a newer change
+    of the same attribute replaces the pending one, and a batch is sent once `batch_size` changes are pending or the oldest pending change
+    waited `max_delay` seconds. Batches of a webhook are sent one after another, failed batches are retried with exponential backoff and
+    dead-lettered after `max_retries` retries. Dead-lettered batches are kept in memory and can be sent again.
+
+    Args:
+        car_connectivity (CarConnectivity): The CarConnectivity instance to observe.
+        webhooks (List[Webhook]): The webhooks.
+        max_queue (int): Maximum number of changes waiting in the queue.
+        max_dead_letters (int): Maximum number of dead-lettered batches that are kept, the oldest are discarded.
+    """
+    def __init__(self, car_connectivity: CarConnectivity, webhooks: List[Webhook], max_queue: int = 1000, max_dead_letters: int = 100) -> None:
+        self.car_connectivity: CarConnectivity = car_connectivity
+        self.webhooks: Dict[str, Webhook] = {webhook.name: webhook for webhook in webhooks}
+        self.queue: queue.Queue[Tuple[Webhook, Dict[str, Any]]] = queue.Queue(maxsize=max_queue)
+        self.dead_letters: Deque[Dict[str, Any]] = deque(maxlen=max_dead_letters)
+        self.lock: threading.Lock = threading.Lock()
+        self.pending: Dict[str, Dict[str, Dict[str, Any]]] = {name: {} for name in self.webhooks}
+        self.pending_since: Dict[str, Optional[float]] = {name: None for name in self.webhooks}
+        self.inflight: Dict[str, Optional[concurrent.futures.Future]] = {name: None for name in self.webhooks}
+        self.executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.stop_event: threading.Event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.running: bool = False
+        self._observing: bool = False
+
+    def _on_change(self, element: Any, flags: Observable.ObserverEvent) -> None:
+        if not self.running or not isinstance(element, GenericAttribute):
+            return
+        path: str = element.get_absolute_path()
+        webhooks: List[Webhook] = [webhook for webhook in self.webhooks.values() if not webhook.paused and webhook.matches(path)]
+        if not webhooks:
+            return
+        # The value is taken now, it may already have changed again when the batch is sent
+        change: Dict[str, Any] = {'path': path, 'event': event_name(flags), 'time': datetime.now(tz=timezone.utc).isoformat()}
+        if element.enabled:
+            change.update(element.as_dict() or {})
+        for webhook in webhooks:
+            try:
+                self.queue.put_nowait((webhook, change))
+                webhook.count('queued')
+            except queue.Full:
+                webhook.count('dropped')
+
+    def _add_pending(self, webhook: Webhook, change: Dict[str, Any]) -> None:
+        with self.lock:
+            pending: Dict[str, Dict[str, Any]] = self.pending[webhook.name]
+            if change['path'] in pending:
+                # Removed and inserted again, so the batch is ordered by the time of the last change
+                del pending[change['path']]
+                webhook.count('coalesced')
+            pending[change['path']] = change
+            if self.pending_since[webhook.name] is None:
+                self.pending_since[webhook.name] = time.monotonic()
+
+    def _next_timeout(self) -> float:
+        with self.lock:
+            deadlines: List[float] = [since + self.webhooks[name].max_delay for name, since in self.pending_since.items() if since is not None]
+        if not deadlines:
+            return 1.0
+        return min(max(min(deadlines) - time.monotonic(), 0.0), 1.0)
+
+    def _flush(self, force: bool = False) -> None:
+        now: float = time.monotonic()
+        with self.lock:
+            for name, webhook in self.webhooks.items():
+                pending: Dict[str, Dict[str, Any]] = self.pending[name]
+                since: Optional[float] = self.pending_since[name]
+                if not pending or since is None:
+                    continue
+                inflight: Optional[concurrent.futures.Future] = self.inflight[name]
+                if inflight is not None and not inflight.done() and not force:
+                    # Changes keep being collected while the previous batch is sent, pending changes are bounded by the number of attributes
+                    continue
+                if not force and len(pending) < webhook.batch_size and now - since < webhook.max_delay:
+                    continue
+                batches: List[Tuple[str, List[Dict[str, Any]]]] = []
+                while pending:
+                    paths: List[str] = list(pending)[:webhook.batch_size]
+                    batches.append((str(uuid.uuid4()), [pending.pop(path) for path in paths]))
+                    if not force:
+                        break
+                self._submit(webhook, batches)
+                self.pending_since[name] = now if pending else None
+
+    def _submit(self, webhook: Webhook, batches: List[Tuple[str, List[Dict[str, Any]]]]) -> None:
+        # Must be called with the lock held. The batches are sent one after another once the batch in flight is done, so a webhook never
+        # receives two batches at the same time and receives them in order.
+        if self.executor is not None:
+            self.inflight[webhook.name] = self.executor.submit(self._deliver_batches, webhook, batches, self.inflight[webhook.name])
+
+    def _deliver_batches(self, webhook: Webhook, batches: List[Tuple[str, List[Dict[str, Any]]]],
+                         previous: Optional[concurrent.futures.Future]) -> None:
+        # The previous task was submitted earlier and is already running on another worker of the executor, waiting cannot deadlock
+        if previous is not None:
+            concurrent.futures.wait([previous])
+        for delivery_id, changes in batches:
+            self._deliver(webhook, delivery_id, changes)
+
+    def _deliver(self, webhook: Webhook, delivery_id: str, changes: List[Dict[str, Any]]) -> bool:
+        attempt: int = 0
+        while True:
+            response: Optional[requests.Response] = None
+            try:
+                response = webhook.post(delivery_id, changes)
+                if response.ok:
+                    return True
+                error: str = f'HTTP {response.status_code} {response.reason}'
+                retryable: bool = response.status_code in RETRY_STATUS_CODES
+            except requests.RequestException as err:
+                error = str(err)
+                retryable = True
+            if not retryable or attempt >= webhook.max_retries or self.stop_event.is_set():
+                break
+            delay: float = webhook.retry_delay(attempt, response)
+            LOG.debug('Delivery %s to webhook %s failed (%s), retrying in %.1fs', delivery_id, webhook.name, error, delay)
+            webhook.count('retries')
+            attempt += 1
+            if self.stop_event.wait(delay):
+                break
+        LOG.warning('Delivery %s of %d changes to webhook %s failed after %d attempts, dead-lettering it: %s', delivery_id, len(changes),
+                    webhook.name, attempt + 1, error)
+        webhook.count('dead_lettered')
+        with self.lock:
+            self.dead_letters.append({'webhook': webhook.name, 'delivery': delivery_id, 'time': datetime.now(tz=timezone.utc).isoformat(),
+                                      'attempts': attempt + 1, 'error': error, 'changes': changes})
+        return False
+
+    def retry_dead_letters(self, name: Optional[str] = None) -> int:
+        """
+        Send dead-lettered batches again with their original changes and delivery id, so receivers can discard batches they already
+        processed. The batches are sent after the batch in flight of their webhook. Batches are only sent again while the dispatcher is
+        running.
+
+        Args:
+            name (Optional[str]): Only retry batches of this webhook, None for all webhooks.
+
+        Returns:
+            int: The number of batches that are sent again.
+        """
+        with self.lock:
+            if self.executor is None:
+                return 0
+            letters: List[Dict[str, Any]] = [letter for letter in self.dead_letters
+                                             if letter['webhook'] in self.webhooks and (name is None or letter['webhook'] == name)]
+            for letter in letters:
+                self.dead_letters.remove(letter)
+            for webhook_name, webhook in self.webhooks.items():
+                batches: List[Tuple[str, List[Dict[str, Any]]]] = [(letter['delivery'], letter['changes']) for letter in letters
+                                                                   if letter['webhook'] == webhook_name]
+                if batches:
+                    self._submit(webhook, batches)
+        return len(letters)
+
+    def get_dead_letters(self) -> List[Dict[str, Any]]:
+        """
+        Returns the dead-lettered batches, the oldest first.
+
+        Returns:
+            List[Dict[str, Any]]: Copy of the dead-lettered batches with webhook, delivery id, time, attempts, last error and changes.
+        """
+        with self.lock:
+            return list(self.dead_letters)
+
+    def clear_dead_letters(self, name: Optional[str] = None) -> int:
+        """
+        Discard dead-lettered batches.
+
+        Args:
+            name (Optional[str]): Only discard batches of this webhook, None for all webhooks.
+
+        Returns:
+            int: The number of discarded batches.
+        """
+        with self.lock:
+            letters: List[Dict[str, Any]] = [letter for letter in self.dead_letters if name is None or letter['webhook'] == name]
+            for letter in letters:
+                self.dead_letters.remove(letter)
+        return len(letters)
+
+    def send_test(self, name: str) -> Tuple[bool, str]:
+        """
+        Post a batch with a single test change to a webhook once, without retries.
+
+        Args:
+            name (str): The name of the webhook.
+
+        Returns:
+            Tuple[bool, str]: True if the endpoint accepted the batch and a message describing the outcome.
+
+        Raises:
+            KeyError: If the webhook does not exist.
+        """
+        webhook: Webhook = self.webhooks[name]
+        change: Dict[str, Any] = {'path': '/webhooks/test', 'event': 'test', 'time': datetime.now(tz=timezone.utc).isoformat(), 'val': None}
+        try:
+            response: requests.Response = webhook.post(str(uuid.uuid4()), [change])
+        except requests.RequestException as err:
+            return False, str(err)
+        return response.ok, f'HTTP {response.status_code} {response.reason} after {webhook.status()["last_latency_ms"]}ms'
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Returns the state of the queue, the status of each webhook including its pending changes and the number of dead-lettered batches.
+
+        Returns:
+            Dict[str, Any]: The dispatcher status.
+        """
+        webhooks: Dict[str, Dict[str, Any]] = {}
+        for name, webhook in self.webhooks.items():
+            webhooks[name] = webhook.status()
+            with self.lock:
+                webhooks[name]['pending'] = len(self.pending[name])
+                inflight: Optional[concurrent.futures.Future] = self.inflight[name]
+                webhooks[name]['inflight'] = inflight is not None and not inflight.done()
+                webhooks[name]['dead_letters'] = len([letter for letter in self.dead_letters if letter['webhook'] == name])
+        with self.lock:
+            dead_letters: int = len(self.dead_letters)
+        return {
+            'running': self.running,
+            'queue': {'size': self.queue.qsize(), 'capacity': self.queue.maxsize},
+            'dead_letters': {'size': dead_letters, 'capacity': self.dead_letters.maxlen},
+            'webhooks': webhooks,
+        }
+
+    # pylint: disable=duplicate-code
+    def start(self) -> None:
+        """
+        Start observing CarConnectivity and sending changes to the webhooks.
+        """
+        self.stop_event.clear()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(self.webhooks), 1),
+                                                              thread_name_prefix='carconnectivity.plugins.webui-webhooks-delivery')
+        self.running = True
+        if not self._observing:
+            # Observers of an object are notified for changes of all its children. The observer is never removed again as
+            # Observable.remove_observer removes all other observers instead, after stop() it ignores notifications.
+            self.car_connectivity.add_observer(self._on_change, flag=OBSERVED_EVENTS, priority=Observable.ObserverPriority.USER_LOW)
+            self._observing = True
+        self.thread = threading.Thread(target=self._loop, name='carconnectivity.plugins.webui-webhooks')
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop observing, send the pending changes once and close all connections. Batches that cannot be sent are dead-lettered.
+        """
+        self.running = False
+        self.stop_event.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join()
+        self.thread = None
+        with self.lock:
+            executor: Optional[concurrent.futures.ThreadPoolExecutor] = self.executor
+            self.executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        for webhook in self.webhooks.values():
+            webhook.close()
+    # pylint: enable=duplicate-code
+
+    def _drain(self) -> None:
+        while True:
+            try:
+                webhook, change = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            self._add_pending(webhook, change)
+
+    def _loop(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                webhook, change = self.queue.get(timeout=self._next_timeout())
+                self._add_pending(webhook, change)
+                self._drain()
+            except queue.Empty:
+                pass
+            self._flush()
+        self._drain()
+        self._flush(force=True)
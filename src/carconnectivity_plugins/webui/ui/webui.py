@@ -9,9 +9,8 @@ from datetime import timedelta
 from decimal import Decimal
 import base64
 import threading
-import time
+import tracemalloc
 import os
-import sys
 import uuid
 import logging
 from flask_bootstrap import Bootstrap5
@@ -19,29 +18,42 @@ import flask
 import flask_login
 import markupsafe
 
-from flask_wtf.csrf import CSRFProtect
+from flask_wtf.csrf import CSRFProtect, generate_csrf
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, PasswordField, BooleanField
 from wtforms.validators import Length
 
 from werkzeug.serving import make_server, _TSSLContextArg
+from werkzeug.wsgi import ClosingIterator
 
 from carconnectivity.attributes import GenericAttribute, FloatAttribute
 from carconnectivity.objects import GenericObject
 from carconnectivity_connectors.base.ui.connector_ui import BaseConnectorUI
 
 from carconnectivity_plugins.base.ui.plugin_ui import BasePluginUI
-from carconnectivity_plugins.webui.ui.cache import cache
+from carconnectivity_plugins.webui.ui.cache import cache, cacheable_response, make_cache_key
+from carconnectivity_plugins.webui.ui.formats import negotiate_format, element_response
 from carconnectivity_plugins.webui.ui.plugins import bp_plugins
 from carconnectivity_plugins.webui.ui.connectors import bp_connectors
 from carconnectivity_plugins.webui.ui.garage import blueprint as bp_garage
+from carconnectivity_plugins.webui.ui.federation import blueprint as bp_federation
+from carconnectivity_plugins.webui.ui.snapshot import SnapshotStore, stale_response
+from carconnectivity_plugins.webui.ui.vehicle_index import VehicleIndex
+from carconnectivity_plugins.webui.ui.reload import Reloader
+from carconnectivity_plugins.webui.ui.admission import AdmissionController
+from carconnectivity_plugins.webui.ui.compression import Compressor
+from carconnectivity_plugins.webui.ui.memory import MemoryMonitor
+from carconnectivity_plugins.webui.ui.tls import HandshakeStatistics, ServerSSLContext, track_handshakes
+from carconnectivity_plugins.webui._version import __version__
 
 if TYPE_CHECKING:
-    from typing import Dict, Optional, Literal
+    from typing import Any, Callable, Dict, Iterable, Optional, Literal
     from types import ModuleType
 
     from carconnectivity.carconnectivity import CarConnectivity
     from werkzeug.serving import BaseWSGIServer
+    from carconnectivity_plugins.webui.ui.federation import Federation
+    from _typeshed.wsgi import WSGIApplication, WSGIEnvironment, StartResponse
 
 LOG: logging.Logger = logging.getLogger("carconnectivity.plugins.webui")
 
@@ -64,14 +76,20 @@ class LoginForm(FlaskForm):
     submit = SubmitField('Submit')
 
 
-class WebUI:  # pylint: disable=too-few-public-methods
+class WebUI:  # pylint: disable=too-many-instance-attributes
     """
     WebUI class for the Car Connectivity application.
     """
     # pylint: disable-next=too-many-arguments, too-many-positional-arguments, too-many-locals, too-many-statements
     def __init__(self, car_connectivity: CarConnectivity, host: str, port: int, app_config: Optional[Dict[str, str]] = None,
-                 users: Optional[Dict[str, str]] = None, locale: Optional[str] = None, ssl_context: Optional[_TSSLContextArg] = None) -> None:
+                 users: Optional[Dict[str, str]] = None, locale: Optional[str] = None, ssl_context: Optional[_TSSLContextArg] = None,
+                 config_file: Optional[str] = None, drain_timeout: float = 10.0, federation: Optional[Federation] = None,
+                 admission: Optional[AdmissionController] = None, retry_after: int = 1, snapshot: Optional[SnapshotStore] = None,
+                 compressor: Optional[Compressor] = None, memory_monitor: Optional[MemoryMonitor] = None) -> None:
         self.locale: Optional[str] = locale
+        self.host: str = host
+        self.port: int = port
+        self.ssl_context: Optional[_TSSLContextArg] = ssl_context
         if app_config is None:
             app_config = {}
         self.users: Dict[str, Dict[str, str]] = {}
@@ -114,11 +132,28 @@ class WebUI:  # pylint: disable=too-few-public-methods
         #  Disable logging for healthcheck
         logging.getLogger("werkzeug").addFilter(NoHealth())
 
+        self.federation: Optional[Federation] = federation
+        self.snapshot: Optional[SnapshotStore] = snapshot
+
         with self.app.app_context():
             if 'carconnectivity' not in flask.current_app.extensions:
                 flask.current_app.extensions['car_connectivity'] = car_connectivity
-
-        self.server: BaseWSGIServer = make_server(host, port, self.app, threaded=True, ssl_context=ssl_context)
+            flask.current_app.extensions['carconnectivity_federation'] = federation
+            flask.current_app.extensions['carconnectivity_snapshot'] = snapshot
+            flask.current_app.extensions['carconnectivity_vehicle_index'] = VehicleIndex(car_connectivity.garage)
+            flask.current_app.extensions['carconnectivity_locale'] = locale
+
+        self.inflight_requests: int = 0
+        self.inflight_condition: threading.Condition = threading.Condition()
+        self.app.wsgi_app = self._track_inflight_requests(self.app.wsgi_app)  # type: ignore[method-assign]
+        self.admission: Optional[AdmissionController] = admission
+        if admission is not None:
+            self.app.wsgi_app = admission.wrap(self.app.wsgi_app, retry_after=retry_after)  # type: ignore[method-assign]
+
+        self.tls_statistics: Optional[HandshakeStatistics] = HandshakeStatistics() if isinstance(ssl_context, ServerSSLContext) else None
+        self.server: Optional[BaseWSGIServer] = self._make_server()
+        self.webthread: Optional[threading.Thread] = None
+        self.reloader: Reloader = Reloader(self, config_file=config_file, drain_timeout=drain_timeout)
 
         self.plugin_uis: Dict[str, BasePluginUI] = {}
         self.connector_uis: Dict[str, BaseConnectorUI] = {}
@@ -222,6 +257,8 @@ class WebUI:  # pylint: disable=too-few-public-methods
                 },
                 {"text": "Log", "url": flask.url_for('log')},
             ]
+            if flask.current_app.extensions.get('carconnectivity_federation') is not None:
+                nav.insert(1, {"text": "Federation", "url": flask.url_for('federation.garage')})
             if 'carconnectivity_connector_uis' in flask.current_app.extensions and flask.current_app.extensions['carconnectivity_connector_uis'] is not None:
                 connector_uis: Dict = flask.current_app.extensions['carconnectivity_connector_uis']
                 connectors_sublinks.append({"text": "Status", "url": flask.url_for('connectors.status')})
@@ -257,6 +294,19 @@ class WebUI:  # pylint: disable=too-few-public-methods
             # flask.g.versions['VWsFriend'] = __vwsfriend_version__
             # flask.g.versions['WeConnect Python Library'] = __weconnect_version__
 
+        self.compressor: Optional[Compressor] = compressor
+        self.memory_monitor: MemoryMonitor = memory_monitor if memory_monitor is not None else MemoryMonitor(car_connectivity)
+        if compressor is not None:
+            # after_request functions run in reverse order of registration, so responses are compressed after the ETag was checked
+            self.app.after_request(compressor.after_request())
+
+        @self.app.after_request
+        def conditional_response(response: flask.Response) -> flask.Response:
+            # Answer requests with a matching If-None-Match with 304 Not Modified for responses that carry an ETag
+            if flask.request.method == 'GET' and response.status_code == 200 and response.get_etag()[0] is not None:
+                response.make_conditional(flask.request)
+            return response
+
         @self.app.route('/', methods=['GET'])
         def root():
             return flask.redirect(flask.url_for('garage.garage'))
@@ -271,22 +321,108 @@ class WebUI:  # pylint: disable=too-few-public-methods
                     return 'ok'
             return 'unhealthy'
 
-        @self.app.route('/restart', methods=['GET'])
+        @self.app.route('/restart', methods=['POST'])
         @flask_login.login_required
         def restart():
-            def delayed_restart():
-                time.sleep(10)
-                python = sys.executable
-                os.execl(python, python, * sys.argv)  # nosec
-
-            t = threading.Thread(target=delayed_restart)
-            t.start()
-            return flask.redirect(flask.url_for('restartrefresh'))
+            target: str = flask.request.form.get('target', default='all', type=str)
+            try:
+                if not self.reloader.start(target):
+                    flask.flash('Another restart is still in progress', 'warning')
+            except ValueError as err:
+                flask.abort(400, str(err))
+            # The progress page is answered directly instead of a redirect, the web server may already be restarting when it is requested
+            return flask.render_template('restart.html', current_app=flask.current_app)
 
         @self.app.route('/restartrefresh', methods=['GET'])
         def restartrefresh():
             return flask.render_template('restart.html', current_app=flask.current_app)
 
+        @self.app.route('/restart/status', methods=['GET'])
+        @flask_login.login_required
+        def restart_status() -> flask.Response:
+            response: flask.Response = flask.jsonify(self.reloader.status())
+            response.cache_control.no_store = True
+            return response
+
+        @self.app.route('/admission/status', methods=['GET'])
+        @flask_login.login_required
+        def admission_status() -> flask.Response:
+            if self.admission is None:
+                flask.abort(404, "Admission control is disabled")
+            response: flask.Response = flask.jsonify(self.admission.status())
+            response.cache_control.no_store = True
+            return response
+
+        @self.app.route('/compression/status', methods=['GET'])
+        @flask_login.login_required
+        def compression_status() -> flask.Response:
+            if self.compressor is None:
+                flask.abort(404, "Compression is disabled")
+            response: flask.Response = flask.jsonify(self.compressor.status())
+            response.cache_control.no_store = True
+            return response
+
+        @self.app.route('/debug/memory', methods=['GET', 'POST'])
+        @flask_login.login_required
+        def debug_memory() -> flask.Response:
+            # GET only reads the memory usage, tracemalloc is controlled with POST requests that carry the CSRF token of the response
+            memory: Dict[str, Any] = self.memory_monitor.status()
+            action: Optional[str] = None
+            if flask.request.method == 'POST':
+                action = flask.request.form.get('tracemalloc', default='', type=str)
+            top: int = flask.request.form.get('top', default=20, type=int)
+            try:
+                if action == 'start':
+                    self.memory_monitor.tracemalloc_start(frames=flask.request.form.get('frames', default=1, type=int))
+                elif action == 'stop':
+                    self.memory_monitor.tracemalloc_stop()
+                elif action in ('snapshot', 'diff'):
+                    memory['tracemalloc_top'] = self.memory_monitor.tracemalloc_top(top=top, diff=action == 'diff')
+                elif action is not None:
+                    flask.abort(400, "tracemalloc must be one of start, stop, snapshot or diff")
+            except RuntimeError as err:
+                flask.abort(409, str(err))
+            memory['tracemalloc'] = tracemalloc.is_tracing()
+            memory['csrf_token'] = generate_csrf()
+            response: flask.Response = flask.jsonify(memory)
+            response.cache_control.no_store = True
+            return response
+
+        @self.app.route('/tls/status', methods=['GET'])
+        @flask_login.login_required
+        def tls_status() -> flask.Response:
+            if self.tls_statistics is None:
+                flask.abort(404, "https is disabled")
+            response: flask.Response = flask.jsonify(self.tls_statistics.status())
+            response.cache_control.no_store = True
+            return response
+
+        @self.app.route('/service-worker.js', methods=['GET'])
+        def service_worker() -> flask.Response:
+            precache_urls = [flask.url_for('static', filename=filename) for filename in
+                             ['css/bootstrap.css', 'css/style.css', 'js/bootstrap.bundle.min.js', 'icons/vehicle.png', 'icons/pin.png']]
+            response = flask.Response(flask.render_template('pwa/service-worker.js', version=__version__, precache_urls=precache_urls),
+                                      mimetype='application/javascript')
+            # The browser has to check for a new service worker on every navigation to pick up upgrades
+            response.cache_control.no_cache = True
+            response.headers['Service-Worker-Allowed'] = '/'
+            return response
+
+        @self.app.route('/manifest.webmanifest', methods=['GET'])
+        def manifest() -> flask.Response:
+            response = flask.json.jsonify({
+                'name': 'CarConnectivity',
+                'short_name': 'CarConnectivity',
+                'start_url': flask.url_for('garage.garage'),
+                'scope': flask.url_for('root'),
+                'display': 'standalone',
+                'background_color': '#ffffff',
+                'theme_color': '#212529',
+                'icons': [{'src': flask.url_for('static', filename='icons/vehicle.png'), 'type': 'image/png', 'sizes': 'any'}],
+            })
+            response.mimetype = 'application/manifest+json'
+            return response
+
         @login_manager.user_loader
         def user_loader(username) -> None | flask_login.UserMixin:
             if username not in self.users:
@@ -369,11 +505,14 @@ class WebUI:  # pylint: disable=too-few-public-methods
 
         # pylint: disable=duplicate-code
         @self.app.route('/json', methods=['GET'])
-        @cache.cached(timeout=5)
         @flask_login.login_required
+        @cache.cached(timeout=5, make_cache_key=make_cache_key, response_filter=cacheable_response)
         def json_status() -> flask.Response:
             car_connectivity: Optional[CarConnectivity] = flask.current_app.extensions['car_connectivity']
             if car_connectivity is not None:
+                snapshot_response: Optional[flask.Response] = stale_response('json')
+                if snapshot_response is not None:
+                    return snapshot_response
                 pretty: bool = flask.request.args.get('pretty', default=False, type=bool)
                 in_locale: bool = flask.request.args.get('in_locale', default=False, type=bool)
                 with_locale: Optional[str] = flask.request.args.get('with_locale', default=None, type=str)
@@ -384,8 +523,7 @@ class WebUI:  # pylint: disable=too-few-public-methods
                     with_local_str = car_connectivity.connectors.connectors['webui'].active_config['locale']
                 else:
                     with_local_str = None
-                json: str = car_connectivity.as_json(pretty=pretty, in_locale=with_local_str)
-                response = flask.Response(json, mimetype="text/json")
+                response = element_response(car_connectivity, negotiate_format(), pretty=pretty, in_locale=with_local_str)
                 response.cache_control.max_age = 5
                 response.cache_control.private = True
                 response.cache_control.public = False
@@ -393,6 +531,59 @@ class WebUI:  # pylint: disable=too-few-public-methods
             flask.abort(500, "car_connectivity instance not connected")
         # pylint: enable=duplicate-code
 
+    def _track_inflight_requests(self, wsgi_app: WSGIApplication) -> Callable[[WSGIEnvironment, StartResponse], Iterable[bytes]]:
+        def release() -> None:
+            with self.inflight_condition:
+                self.inflight_requests -= 1
+                self.inflight_condition.notify_all()
+
+        def wsgi_app_with_tracking(environ: WSGIEnvironment, start_response: StartResponse) -> Iterable[bytes]:
+            with self.inflight_condition:
+                self.inflight_requests += 1
+            try:
+                # Streamed bodies and files are sent after the application returned, the request is over when the server closes the body
+                return ClosingIterator(wsgi_app(environ, start_response), release)
+            except BaseException:
+                release()
+                raise
+        return wsgi_app_with_tracking
+
+    def _make_server(self) -> BaseWSGIServer:
+        server: BaseWSGIServer = make_server(self.host, self.port, self.app, threaded=True, ssl_context=self.ssl_context)
+        if self.tls_statistics is not None:
+            track_handshakes(server, self.tls_statistics)
+        return server
+
+    def start_server(self) -> None:
+        """
+        Start serving the web UI in a separate thread. If the server was stopped before, a new server is created.
+        """
+        if self.server is None:
+            self.server = self._make_server()
+        self.webthread = threading.Thread(target=self.server.serve_forever)
+        self.webthread.name = 'carconnectivity.plugins.webui-webthread'
+        self.webthread.start()
+
+    def stop_server(self, drain_timeout: Optional[float] = None) -> bool:
+        """
+        Stop accepting new connections and wait for in-flight requests to finish.
+
+        Args:
+            drain_timeout (Optional[float]): Maximum time in seconds to wait for in-flight requests. None waits forever.
+
+        Returns:
+            bool: True if all in-flight requests finished, False if the timeout was reached.
+        """
+        if self.server is not None:
+            if self.webthread is not None and self.webthread.is_alive():
+                self.server.shutdown()
+                self.webthread.join()
+            self.server.server_close()
+            self.server = None
+        self.webthread = None
+        with self.inflight_condition:
+            return self.inflight_condition.wait_for(lambda: self.inflight_requests == 0, timeout=drain_timeout)
+
     def load_blueprints(self) -> None:
         """
         Load and register blueprints for plugins and connectors.
@@ -444,5 +635,6 @@ class WebUI:  # pylint: disable=too-few-public-methods
             flask.current_app.register_blueprint(bp_plugins)
             flask.current_app.register_blueprint(bp_connectors)
             flask.current_app.register_blueprint(bp_garage)
+            flask.current_app.register_blueprint(bp_federation)
             flask.current_app.extensions['carconnectivity_plugin_uis'] = self.plugin_uis
             flask.current_app.extensions['carconnectivity_connector_uis'] = self.connector_uis
@@ -0,0 +1,92 @@
+""" Benchmark comparing the JSON output with the binary (MessagePack/CBOR) output formats of the web UI.
+
+Usage: python test/benchmark/benchmark_formats.py [number of vehicles]
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import io
+import json
+import sys
+import timeit
+from base64 import b64encode
+from datetime import datetime, timezone
+
+from carconnectivity.objects import GenericObject
+from carconnectivity.garage import Garage
+from carconnectivity.vehicle import ElectricVehicle
+
+from carconnectivity_plugins.webui.ui.formats import available_formats, as_native_dict, encode, decode
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Dict, Tuple
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None  # pylint: disable=invalid-name
+
+ROUNDS: int = 50
+
+
+def build_garage(number_of_vehicles: int) -> Garage:
+    """ Build a garage with synthetic vehicles """
+    root = GenericObject(object_id='carconnectivity')
+    garage = Garage(parent=root)
+    for index in range(number_of_vehicles):
+        measured: datetime = datetime.now(tz=timezone.utc)
+        vehicle = ElectricVehicle(vin=f'BENCHVIN{index:09d}', garage=garage, managing_connector=None)
+        vehicle.name._set_value(f'Vehicle {index}', measured=measured)  # pylint: disable=protected-access
+        vehicle.model._set_value('ID.3', measured=measured)  # pylint: disable=protected-access
+        vehicle.license_plate._set_value(f'B-CC {index}', measured=measured)  # pylint: disable=protected-access
+        vehicle.odometer._set_value(12345.6 + index, measured=measured)  # pylint: disable=protected-access
+        vehicle.charging.power._set_value(11.0, measured=measured)  # pylint: disable=protected-access
+        garage.add_vehicle(vehicle.vin.value, vehicle)
+    return garage
+
+
+def measure(encoder: Callable[[], Any], decoder: Callable[[Any], Any]) -> Tuple[int, float, float]:
+    """ Returns size in bytes and average encode and decode time in milliseconds """
+    encoded = encoder()
+    encode_time: float = timeit.timeit(encoder, number=ROUNDS) / ROUNDS * 1000
+    decode_time: float = timeit.timeit(lambda: decoder(encoded), number=ROUNDS) / ROUNDS * 1000
+    return len(encoded), encode_time, decode_time
+
+
+def print_results(title: str, results: Dict[str, Tuple[int, float, float]]) -> None:
+    """ Print a result table relative to JSON """
+    json_size: int = results['json'][0]
+    print(title)
+    print(f'{"format":<10}{"bytes":>10}{"vs json":>10}{"encode ms":>12}{"decode ms":>12}')
+    for format_name, (size, encode_time, decode_time) in results.items():
+        print(f'{format_name:<10}{size:>10}{size / json_size:>10.2f}{encode_time:>12.3f}{decode_time:>12.3f}')
+    print()
+
+
+def main() -> None:
+    """ Run the benchmark """
+    number_of_vehicles: int = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    garage: Garage = build_garage(number_of_vehicles)
+
+    results: Dict[str, Tuple[int, float, float]] = {}
+    results['json'] = measure(lambda: garage.as_json().encode(), json.loads)
+    for format_name in available_formats()[1:]:
+        results[format_name] = measure(lambda format_name=format_name: encode(as_native_dict(garage), format_name),
+                                       lambda data, format_name=format_name: decode(data, format_name))
+    print_results(f'Garage with {number_of_vehicles} vehicles', results)
+
+    if Image is not None:
+        img_io = io.BytesIO()
+        Image.effect_noise((400, 200), 64).convert('RGB').save(img_io, 'PNG')
+        png: bytes = img_io.getvalue()
+        results = {}
+        results['json'] = measure(lambda: json.dumps({'type': 'image/png', 'encoding': 'base64', 'data': b64encode(png).decode()}).encode(),
+                                  json.loads)
+        for format_name in available_formats()[1:]:
+            results[format_name] = measure(lambda format_name=format_name: encode({'type': 'image/png', 'encoding': 'binary', 'data': png}, format_name),
+                                           lambda data, format_name=format_name: decode(data, format_name))
+        print_results(f'Vehicle image ({len(png)} bytes PNG)', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+""" Fixtures for the tests of the web UI plugin"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import threading
+
+import pytest
+
+from werkzeug.serving import make_server
+
+if TYPE_CHECKING:
+    from typing import Callable, Iterator, List
+
+    from werkzeug.serving import BaseWSGIServer
+
+
+@pytest.fixture
+def stand_in() -> Iterator[Callable[[Callable], str]]:
+    """
+    Start local HTTP servers standing in for remote services. The fixture returns a function that serves a WSGI application
+    on a free port of localhost and returns its base URL. All servers are shut down after the test.
+    """
+    servers: List[BaseWSGIServer] = []
+
+    def serve(app: Callable) -> str:
+        server: BaseWSGIServer = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_port}'
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
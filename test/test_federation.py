@@ -0,0 +1,114 @@
+""" Tests for the federation of CarConnectivity instances against local stand-in instances"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import json
+import time
+
+import flask
+import flask_login
+from werkzeug.wrappers import Request, Response
+
+from carconnectivity_plugins.webui.ui import federation as federation_module
+from carconnectivity_plugins.webui.ui.federation import Federation, RemoteInstance
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Dict, List, Optional
+
+
+def garage_instance(garage: Dict[str, Any], etag: str = '"1"', delay: float = 0.0, requests: Optional[List[Request]] = None) -> Callable:
+    """
+    WSGI application standing in for the web UI of a remote instance, it answers /garage/json with `garage` and supports If-None-Match.
+    """
+    @Request.application
+    def application(request: Request) -> Response:
+        if requests is not None:
+            requests.append(request)
+        time.sleep(delay)
+        if request.path != '/garage/json':
+            return Response(status=404)
+        if request.headers.get('If-None-Match') == etag:
+            return Response(status=304, headers={'ETag': etag})
+        return Response(json.dumps(garage), mimetype='application/json', headers={'ETag': etag})
+    return application
+
+
+class LocalGarage:  # pylint: disable=too-few-public-methods
+    """ Garage of the local instance """
+    def as_json(self) -> str:
+        """ Returns the local garage as json """
+        return json.dumps({'LOCALVIN': {'name': {'val': 'Local car'}}})
+
+
+class LocalCarConnectivity:  # pylint: disable=too-few-public-methods
+    """ Local CarConnectivity instance with a fixed garage """
+    def __init__(self) -> None:
+        self.garage: LocalGarage = LocalGarage()
+
+
+def test_not_modified_keeps_snapshot(stand_in) -> None:
+    """ The second fetch revalidates with If-None-Match and keeps the snapshot on 304 """
+    requests: List[Request] = []
+    url: str = stand_in(garage_instance({'VIN1': {'name': {'val': 'Remote car'}}}, requests=requests))
+    remote = RemoteInstance(name='remote', url=url, timeout=2)
+    try:
+        remote.fetch()
+        remote.fetch()
+    finally:
+        remote.close()
+    assert requests[0].headers.get('If-None-Match') is None
+    assert requests[1].headers.get('If-None-Match') == '"1"'
+    assert remote.snapshot == {'VIN1': {'name': {'val': 'Remote car'}}}
+    assert remote.fetch_count == 2
+    assert remote.not_modified_count == 1
+    assert remote.status()['healthy']
+
+
+def test_slow_remote_does_not_block_others(stand_in) -> None:
+    """ A remote that does not answer in time fails with a timeout while the other remotes are fetched """
+    fast = RemoteInstance(name='fast', url=stand_in(garage_instance({'VIN1': {}})), timeout=1)
+    slow = RemoteInstance(name='slow', url=stand_in(garage_instance({'VIN2': {}}, delay=3)), timeout=0.5)
+    federation = Federation(remotes=[slow, fast])
+    try:
+        start: float = time.monotonic()
+        federation.fetch_all()
+        duration: float = time.monotonic() - start
+        # The slow remote times out after 0.5s, its read is not waited for
+        for _ in range(20):
+            if slow.last_error is not None:
+                break
+            time.sleep(0.1)
+    finally:
+        federation.stop()
+    assert duration < 2
+    assert fast.snapshot == {'VIN1': {}}
+    assert fast.last_error is None
+    assert slow.snapshot is None
+    assert slow.last_error is not None
+    assert not slow.status()['healthy']
+
+
+def test_federation_json_merges_garages(stand_in) -> None:
+    """ /federation/json merges the local garage and the remote snapshots and reports the status of each remote """
+    home = RemoteInstance(name='home', url=stand_in(garage_instance({'VIN1': {'name': {'val': 'Home car'}}})), timeout=2)
+    unreachable = RemoteInstance(name='office', url='http://127.0.0.1:9', timeout=0.5)
+    federation = Federation(remotes=[home, unreachable])
+    app = flask.Flask(__name__)
+    app.config['LOGIN_DISABLED'] = True
+    flask_login.LoginManager(app)
+    app.register_blueprint(federation_module.blueprint)
+    app.extensions['car_connectivity'] = LocalCarConnectivity()
+    app.extensions['carconnectivity_federation'] = federation
+    try:
+        federation.fetch_all()
+        response = app.test_client().get('/federation/json')
+    finally:
+        federation.stop()
+    assert response.status_code == 200
+    merged: Dict[str, Any] = json.loads(response.data)
+    assert merged['local'] == {'LOCALVIN': {'name': {'val': 'Local car'}}}
+    assert merged['home'] == {'VIN1': {'name': {'val': 'Home car'}}}
+    assert 'office' not in merged
+    assert merged['federation']['home']['healthy']
+    assert not merged['federation']['office']['healthy']
+    assert merged['federation']['office']['last_error'] is not None
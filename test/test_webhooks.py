@@ -0,0 +1,159 @@
+""" Tests for the delivery of changes to webhooks against local stand-in endpoints"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import hashlib
+import hmac
+import json
+import threading
+import time
+
+from werkzeug.wrappers import Request, Response
+
+from carconnectivity.attributes import IntegerAttribute
+from carconnectivity.objects import GenericObject
+
+from carconnectivity_plugins.webui.ui.webhooks import SIGNATURE_HEADER, DELIVERY_HEADER, Webhook, WebhookDispatcher
+
+if TYPE_CHECKING:
+    from typing import Callable, Dict, List, Optional, Tuple
+
+
+SECRET: str = 'webhook-secret'
+
+
+def webhook_endpoint(received: List[Request], statuses: Optional[List[int]] = None) -> Callable:
+    """
+    WSGI application standing in for a webhook endpoint, it records all requests and answers with the next status code of `statuses`,
+    200 once all status codes are used.
+    """
+    @Request.application
+    def application(request: Request) -> Response:
+        request.get_data()
+        received.append(request)
+        status: int = statuses.pop(0) if statuses else 200
+        return Response(status=status)
+    return application
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 10.0) -> None:
+    """ Wait until `condition` is true or the timeout is over """
+    deadline: float = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert condition()
+
+
+def vehicle_attributes() -> Tuple[GenericObject, Dict[str, IntegerAttribute]]:
+    """ Returns a root object standing in for CarConnectivity with a vehicle and two of its attributes """
+    root: GenericObject = GenericObject(object_id='')
+    garage: GenericObject = GenericObject(object_id='garage', parent=root)
+    vehicle: GenericObject = GenericObject(object_id='TESTVIN', parent=garage)
+    attributes: Dict[str, IntegerAttribute] = {name: IntegerAttribute(name, parent=vehicle) for name in ('odometer', 'range')}
+    return root, attributes
+
+
+def test_changes_are_coalesced_into_one_signed_batch(stand_in):
+    """ Repeated changes of an attribute are sent once with their last value in a single batch signed with the secret """
+    received: List[Request] = []
+    url: str = stand_in(webhook_endpoint(received))
+    root, attributes = vehicle_attributes()
+    webhook: Webhook = Webhook('test', url, paths=['/garage/*/odometer', '/garage/*/range'], secret=SECRET, max_delay=0.5)
+    dispatcher: WebhookDispatcher = WebhookDispatcher(root, [webhook])  # type: ignore[arg-type]
+    dispatcher.start()
+    try:
+        for value in range(1, 4):
+            attributes['odometer']._set_value(value)  # pylint: disable=protected-access
+        attributes['range']._set_value(400)  # pylint: disable=protected-access
+        wait_for(lambda: webhook.status()['counters']['batches'] == 1)
+    finally:
+        dispatcher.stop()
+
+    assert len(received) == 1
+    body: bytes = received[0].get_data()
+    expected: str = 'sha256=' + hmac.new(SECRET.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    assert hmac.compare_digest(received[0].headers[SIGNATURE_HEADER], expected)
+    changes: Dict[str, int] = {change['path']: change['val'] for change in json.loads(body)['changes']}
+    assert changes == {'/garage/TESTVIN/odometer': 3, '/garage/TESTVIN/range': 400}
+    # Enabling an attribute with its first value is a change of its own, all but the last change of each attribute are coalesced
+    counters: Dict[str, int] = webhook.status()['counters']
+    assert counters['coalesced'] == counters['queued'] - 2 >= 2
+    assert counters['delivered'] == 2
+
+
+def test_batch_is_retried_after_unavailable(stand_in):
+    """ A batch answered with 503 is sent again with the same delivery id and delivered """
+    received: List[Request] = []
+    url: str = stand_in(webhook_endpoint(received, statuses=[503]))
+    root, attributes = vehicle_attributes()
+    webhook: Webhook = Webhook('test', url, max_delay=0.1, backoff=0.1)
+    dispatcher: WebhookDispatcher = WebhookDispatcher(root, [webhook])  # type: ignore[arg-type]
+    dispatcher.start()
+    try:
+        attributes['odometer']._set_value(1)  # pylint: disable=protected-access
+        wait_for(lambda: webhook.status()['counters']['batches'] == 1)
+    finally:
+        dispatcher.stop()
+
+    assert [request.headers[DELIVERY_HEADER] for request in received] == [received[0].headers[DELIVERY_HEADER]] * 2
+    assert webhook.status()['counters']['retries'] == 1
+    assert webhook.status()['healthy']
+    assert not dispatcher.get_dead_letters()
+
+
+def test_batch_is_dead_lettered_after_max_retries(stand_in):
+    """ A batch that still fails after max_retries retries is dead-lettered and can be retried """
+    received: List[Request] = []
+    url: str = stand_in(webhook_endpoint(received, statuses=[503] * 3))
+    root, attributes = vehicle_attributes()
+    webhook: Webhook = Webhook('test', url, max_delay=0.1, max_retries=2, backoff=0.05)
+    dispatcher: WebhookDispatcher = WebhookDispatcher(root, [webhook])  # type: ignore[arg-type]
+    dispatcher.start()
+    try:
+        attributes['odometer']._set_value(1)  # pylint: disable=protected-access
+        wait_for(lambda: len(dispatcher.get_dead_letters()) == 1)
+        assert len(received) == 3
+        assert dispatcher.get_dead_letters()[0]['attempts'] == 3
+        assert dispatcher.get_dead_letters()[0]['error'].startswith('HTTP 503')
+        assert webhook.status()['counters']['dead_lettered'] == 1
+
+        assert dispatcher.retry_dead_letters('test') == 1
+        wait_for(lambda: webhook.status()['counters']['batches'] == 1)
+    finally:
+        dispatcher.stop()
+
+    assert not dispatcher.get_dead_letters()
+    # The batch is sent again unchanged, receivers can recognize it by its delivery id
+    assert received[-1].headers[DELIVERY_HEADER] == received[0].headers[DELIVERY_HEADER]
+    assert json.loads(received[-1].get_data())['changes'][0]['val'] == 1
+
+
+def test_pending_batches_are_sent_one_after_another_on_stop(stand_in):
+    """ Changes pending when the dispatcher stops are sent in batches of batch_size, never two batches at the same time """
+    received: List[Request] = []
+    concurrent: List[int] = [0, 0]
+    lock: threading.Lock = threading.Lock()
+
+    @Request.application
+    def application(request: Request) -> Response:
+        with lock:
+            concurrent[0] += 1
+            concurrent[1] = max(concurrent)
+        request.get_data()
+        time.sleep(0.05)
+        received.append(request)
+        with lock:
+            concurrent[0] -= 1
+        return Response(status=200)
+    url: str = stand_in(application)
+    root, attributes = vehicle_attributes()
+    webhook: Webhook = Webhook('test', url, batch_size=1, max_delay=60)
+    dispatcher: WebhookDispatcher = WebhookDispatcher(root, [webhook])  # type: ignore[arg-type]
+    dispatcher.start()
+    attributes['odometer']._set_value(1)  # pylint: disable=protected-access
+    attributes['range']._set_value(400)  # pylint: disable=protected-access
+    dispatcher.stop()
+
+    paths: List[str] = [json.loads(request.get_data())['changes'][0]['path'] for request in received]
+    assert paths == ['/garage/TESTVIN/odometer', '/garage/TESTVIN/range']
+    assert concurrent[1] == 1